@@ -0,0 +1,202 @@
+"""
+Archive old monthly partitions to compressed CSV
+Exports diagnostics/payments/service_notes partitions older than the
+retention window to ARCHIVE_DIR/<table>/<partition>.csv.gz (with a JSON
+manifest), verifies the row count, then detaches and drops the partition.
+
+Archives stay queryable offline, either with the query command below or any
+tool that reads CSV (e.g. duckdb: SELECT * FROM 'archive/payments/*.csv.gz').
+
+Usage:
+    python archive_partitions.py archive [--keep-months 12] [--dry-run]
+    python archive_partitions.py query payments --where user_id=42 --from 2025-01 --to 2025-06
+
+Needs DATABASE_URL (Supabase > Settings > Database > Connection string);
+detaching partitions is not possible through the REST API.
+"""
+
+import argparse
+import csv
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+from datetime import date, datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+PARTITIONED_TABLES = ('diagnostics', 'payments', 'service_notes')
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(__file__), "archive"))
+ARCHIVE_KEEP_MONTHS = int(os.getenv("ARCHIVE_KEEP_MONTHS", 12))
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def monthly_partitions(conn, table):
+    """[(partition_name, first_day_of_month)] for one parent table"""
+    rows = conn.execute(
+        """
+        SELECT c.relname
+          FROM pg_inherits i
+          JOIN pg_class c ON c.oid = i.inhrelid
+          JOIN pg_class p ON p.oid = i.inhparent
+         WHERE p.relname = %s
+        """,
+        (table,)
+    ).fetchall()
+    pattern = re.compile(rf'^{table}_(\d{{4}})_(\d{{2}})$')
+    partitions = []
+    for (name,) in rows:
+        match = pattern.match(name)
+        if match:  # skips <table>_default
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def export_partition(conn, table, name, month):
+    """COPY a partition into a .csv.gz next to its manifest; returns the manifest"""
+    from psycopg import sql
+
+    folder = os.path.join(ARCHIVE_DIR, table)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{name}.csv.gz")
+    tmp_path = path + ".tmp"
+
+    expected = conn.execute(sql.SQL("SELECT COUNT(*) FROM {}").format(sql.Identifier(name))).fetchone()[0]
+    columns = conn.execute(
+        """
+        SELECT column_name, data_type FROM information_schema.columns
+         WHERE table_name = %s ORDER BY ordinal_position
+        """,
+        (name,)
+    ).fetchall()
+
+    digest = hashlib.sha256()
+    with gzip.open(tmp_path, 'wb') as out:
+        copy_sql = sql.SQL("COPY {} TO STDOUT WITH (FORMAT csv, HEADER)").format(sql.Identifier(name))
+        with conn.cursor().copy(copy_sql) as copy:
+            for chunk in copy:
+                out.write(chunk)
+                digest.update(chunk)
+
+    # Count records (not lines: text columns may contain newlines)
+    with gzip.open(tmp_path, 'rt', newline='') as f:
+        written = sum(1 for _ in csv.reader(f)) - 1
+    if written != expected:
+        os.remove(tmp_path)
+        raise RuntimeError(f"{name}: exported {written} rows, expected {expected}")
+
+    os.replace(tmp_path, path)
+    manifest = {
+        'table': table,
+        'partition': name,
+        'month': month.strftime('%Y-%m'),
+        'rows': expected,
+        'columns': [{'name': c, 'type': t} for c, t in columns],
+        'file': os.path.basename(path),
+        'sha256': digest.hexdigest(),
+        'archived_at': datetime.now(timezone.utc).isoformat()
+    }
+    with open(os.path.join(folder, f"{name}.json"), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def archive(keep_months, dry_run=False):
+    import psycopg
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("❌ DATABASE_URL not set in .env")
+        exit(1)
+
+    cutoff = add_months(date.today().replace(day=1), -keep_months)
+    print(f"\nArchiving partitions before {cutoff:%Y-%m} to {ARCHIVE_DIR}")
+
+    with psycopg.connect(database_url, autocommit=True) as conn:
+        if not dry_run:
+            # Roll up everything still in the raw tables before it goes away
+            conn.execute("SELECT refresh_analytics_rollups()")
+
+        for table in PARTITIONED_TABLES:
+            for name, month in monthly_partitions(conn, table):
+                if month >= cutoff:
+                    continue
+                if dry_run:
+                    print(f"   would archive {name}")
+                    continue
+
+                manifest = export_partition(conn, table, name, month)
+                with conn.transaction():
+                    conn.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"')
+                    conn.execute(f'DROP TABLE "{name}"')
+                    # Rollup days from here back are frozen (+1 day covers the IST offset)
+                    conn.execute(
+                        """
+                        UPDATE analytics_refresh_state
+                           SET archived_before = GREATEST(COALESCE(archived_before, '-infinity'::DATE), %s)
+                         WHERE id = 1
+                        """,
+                        (add_months(month, 1) + timedelta(days=1),)
+                    )
+                print(f"   ✓ {name}: {manifest['rows']} rows archived and dropped")
+
+
+def query(table, where, month_from, month_to):
+    """Stream archived rows matching column=value filters as CSV on stdout"""
+    folder = os.path.join(ARCHIVE_DIR, table)
+    if not os.path.isdir(folder):
+        print(f"❌ No archive for {table} in {ARCHIVE_DIR}", file=sys.stderr)
+        exit(1)
+
+    filters = dict(item.split('=', 1) for item in where)
+    writer = None
+    for manifest_name in sorted(os.listdir(folder)):
+        if not manifest_name.endswith('.json'):
+            continue
+        with open(os.path.join(folder, manifest_name)) as f:
+            manifest = json.load(f)
+        if (month_from and manifest['month'] < month_from) or (month_to and manifest['month'] > month_to):
+            continue
+
+        with gzip.open(os.path.join(folder, manifest['file']), 'rt', newline='') as f:
+            reader = csv.DictReader(f)
+            if writer is None:
+                writer = csv.DictWriter(sys.stdout, fieldnames=reader.fieldnames)
+                writer.writeheader()
+            for row in reader:
+                if all(row.get(column) == value for column, value in filters.items()):
+                    writer.writerow(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive and query old monthly partitions")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    archive_cmd = commands.add_parser('archive', help="export and drop partitions past retention")
+    archive_cmd.add_argument('--keep-months', type=int, default=ARCHIVE_KEEP_MONTHS)
+    archive_cmd.add_argument('--dry-run', action='store_true')
+
+    query_cmd = commands.add_parser('query', help="read archived rows")
+    query_cmd.add_argument('table', choices=PARTITIONED_TABLES)
+    query_cmd.add_argument('--where', action='append', default=[], help="column=value (repeatable)")
+    query_cmd.add_argument('--from', dest='month_from', help="YYYY-MM")
+    query_cmd.add_argument('--to', dest='month_to', help="YYYY-MM")
+
+    args = parser.parse_args()
+    if args.command == 'archive':
+        archive(args.keep_months, args.dry_run)
+    else:
+        query(args.table, args.where, args.month_from, args.month_to)
+
+
+if __name__ == '__main__':
+    main()
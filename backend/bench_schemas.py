@@ -0,0 +1,61 @@
+"""
+Benchmark request decoding + validation
+Compares the msgspec schemas in schemas.py with the old json.loads + dict.get
+path for typical request bodies. Run: python bench_schemas.py
+"""
+
+import json
+import timeit
+
+from schemas import (
+    BookingRequest, CompleteJobRequest, DiagnosticRequest, RegisterRequest,
+    VerifyPaymentRequest, decode
+)
+
+SAMPLES = {
+    RegisterRequest: {
+        'name': 'Asha Rao', 'phone': '+919876543210', 'email': 'asha@example.com',
+        'city': 'Mumbai', 'appliance_type': 'AC', 'brand_model': 'Voltas 1.5T',
+        'appliance_age_years': '4', 'usage_hours_per_day': '9.5', 'months_since_service': 14,
+        'current_bill': 3200, 'maintenance_probability': 72.5, 'estimated_savings': 850
+    },
+    DiagnosticRequest: {
+        'name': 'Asha Rao', 'phone': '+919876543210', 'email': 'asha@example.com',
+        'city': 'Mumbai', 'appliance_type': 'Fridge', 'brand_model': 'LG 260L',
+        'year_of_purchase': '2019', 'usage_hours_per_day': 24, 'months_since_service': '20'
+    },
+    BookingRequest: {
+        'user_id': 12, 'appliance_id': 40, 'service_type': 'amc', 'scheduled_date': '2026-11-02'
+    },
+    VerifyPaymentRequest: {
+        'razorpay_order_id': 'order_Nf3kQ2x9', 'razorpay_payment_id': 'pay_Nf3kT7aa',
+        'razorpay_signature': 'a' * 64
+    },
+    CompleteJobRequest: {
+        'technician_id': 3, 'notes': 'Cleaned coils, topped up gas', 'parts_replaced': 'Filter',
+        'verified_savings': '420'
+    }
+}
+
+
+def baseline(body, fields):
+    """What handlers did before: parse, then pick fields with no type checks"""
+    data = json.loads(body)
+    return [data.get(field) for field in fields]
+
+
+def main():
+    print(f"\n{'schema':<24}{'msgspec (us)':>14}{'json+get (us)':>16}")
+    print("-" * 54)
+    for schema, sample in SAMPLES.items():
+        body = json.dumps(sample).encode()
+        decode(schema, body)  # build the decoder outside the timing
+
+        runs = 50000
+        fast = min(timeit.repeat(lambda: decode(schema, body), number=runs, repeat=5)) / runs
+        slow = min(timeit.repeat(lambda: baseline(body, sample), number=runs, repeat=5)) / runs
+        print(f"{schema.__name__:<24}{fast * 1e6:>14.2f}{slow * 1e6:>16.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""
+Change-event fan-out for Bolt Nexus server-sent event (SSE) streams.
+
+Handlers publish booking changes to channels such as "technician:3" or
+"user:7". Every worker process keeps its own subscribers in memory. When
+EVENT_RELAY_ADDRESS is set (gunicorn.conf.py does this), each worker also
+connects to a small relay running next to the gunicorn master, so an event
+published by one worker reaches subscribers connected to the others.
+"""
+
+import json
+import os
+import select
+import signal
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Connection, Listener, answer_challenge, deliver_challenge
+
+# How long to wait before retrying an unreachable relay (seconds)
+RELAY_RETRY_INTERVAL = 5
+
+
+class Subscription:
+    """Pending events for one SSE connection, capped at max_buffer_bytes"""
+
+    def __init__(self, channels, max_buffer_bytes):
+        self.channels = channels
+        self.max_buffer_bytes = max_buffer_bytes
+        self.overflowed = False
+        self._pending = deque()
+        self._pending_bytes = 0
+        self._condition = threading.Condition()
+
+    def push(self, message):
+        """Queue a formatted SSE message; returns False once the budget is blown"""
+        size = len(message)
+        with self._condition:
+            if self.overflowed:
+                return False
+            if self._pending_bytes + size > self.max_buffer_bytes:
+                # A client this far behind has to resync anyway, so free the
+                # buffer now instead of holding on to stale events
+                self.overflowed = True
+                self._pending.clear()
+                self._pending_bytes = 0
+                self._condition.notify()
+                return False
+            self._pending.append(message)
+            self._pending_bytes += size
+            self._condition.notify()
+            return True
+
+    def next(self, timeout):
+        """Return the next message, or None on timeout/overflow"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending or self.overflowed, timeout)
+            if not self._pending:
+                return None
+            message = self._pending.popleft()
+            self._pending_bytes -= len(message)
+            return message
+
+
+class EventBroker:
+    """In-process pub/sub with optional forwarding through the relay"""
+
+    def __init__(self, relay_address=None, relay_authkey=None, max_buffer_bytes=64 * 1024):
+        self.relay_address = relay_address
+        self.relay_authkey = relay_authkey
+        self.max_buffer_bytes = max_buffer_bytes
+        self._origin = uuid.uuid4().hex
+        self._subscribers = {}
+        self._listeners = {}
+        self._lock = threading.Lock()
+        self._relay = None
+        self._relay_lock = threading.Lock()
+        self._relay_retry_at = 0
+
+    def subscribe(self, channels):
+        self._ensure_relay()
+        subscription = Subscription(channels, self.max_buffer_bytes)
+        with self._lock:
+            for channel in channels:
+                self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def add_listener(self, channel, callback):
+        """Call callback(event_type, data) for every event on channel, in-process"""
+        with self._lock:
+            self._listeners.setdefault(channel, []).append(callback)
+        self._ensure_relay()
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def publish(self, channel, event_type, data):
+        """Deliver an event locally and forward it to the other workers"""
+        envelope = {
+            'id': f"{time.time_ns()}-{self._origin[:8]}",
+            'origin': self._origin,
+            'channel': channel,
+            'event': event_type,
+            'data': data
+        }
+        self._deliver(envelope)
+        self._forward(envelope)
+
+    def _deliver(self, envelope):
+        with self._lock:
+            subscribers = list(self._subscribers.get(envelope['channel'], ()))
+            listeners = list(self._listeners.get(envelope['channel'], ()))
+        for callback in listeners:
+            try:
+                callback(envelope['event'], envelope['data'])
+            except Exception as e:
+                print(f"Event listener for {envelope['channel']} failed: {e}")
+        if not subscribers:
+            return
+        message = (
+            f"id: {envelope['id']}\n"
+            f"event: {envelope['event']}\n"
+            f"data: {json.dumps(envelope['data'], default=str)}\n\n"
+        ).encode()
+        for subscription in subscribers:
+            subscription.push(message)
+
+    def _forward(self, envelope):
+        relay = self._ensure_relay()
+        if relay is None:
+            return
+        try:
+            with self._relay_lock:
+                relay.send_bytes(json.dumps(envelope, default=str).encode())
+        except (OSError, EOFError):
+            self._drop_relay(relay)
+
+    def _ensure_relay(self):
+        """Connect to the relay lazily (after fork) and retry with backoff"""
+        if not self.relay_address or self._relay is not None:
+            return self._relay
+        with self._relay_lock:
+            if self._relay is not None or time.monotonic() < self._relay_retry_at:
+                return self._relay
+            try:
+                relay = connect_relay(self.relay_address, self.relay_authkey)
+            except (OSError, EOFError, AuthenticationError) as e:
+                print(f"Event relay unavailable ({e}); serving local subscribers only")
+                self._relay_retry_at = time.monotonic() + RELAY_RETRY_INTERVAL
+                return None
+            self._relay = relay
+        threading.Thread(target=self._listen, args=(relay,), daemon=True).start()
+        return relay
+
+    def _drop_relay(self, relay):
+        with self._relay_lock:
+            if self._relay is relay:
+                self._relay = None
+                self._relay_retry_at = time.monotonic() + RELAY_RETRY_INTERVAL
+        try:
+            relay.close()
+        except OSError:
+            pass
+
+    def _listen(self, relay):
+        while True:
+            try:
+                # Wait through select.poll (patched by gevent) rather than in
+                # recv_bytes' raw os.read, which would block a gevent worker's
+                # whole event loop while the relay is quiet
+                poller = select.poll()
+                poller.register(relay.fileno(), select.POLLIN)
+                poller.poll()
+                envelope = json.loads(relay.recv_bytes())
+            except (OSError, EOFError, ValueError):
+                self._drop_relay(relay)
+                if self._listeners:
+                    # Nothing else may reconnect a worker that only listens
+                    time.sleep(RELAY_RETRY_INTERVAL)
+                    self._ensure_relay()
+                return
+            if envelope.get('origin') != self._origin:
+                self._deliver(envelope)
+
+
+def connect_relay(address, authkey):
+    """multiprocessing's Client(), but safe under gevent's patched socket"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+        # gevent keeps the descriptor non-blocking underneath its sockets;
+        # Connection reads and writes it directly, so make it block again
+        os.set_blocking(sock.fileno(), True)
+        relay = Connection(sock.detach())
+    finally:
+        sock.close()
+    try:
+        answer_challenge(relay, authkey)
+        deliver_challenge(relay, authkey)
+    except BaseException:
+        relay.close()
+        raise
+    return relay
+
+
+def run_relay(address, authkey):
+    """Re-broadcast every message from one worker to all the others"""
+    # Forked from the gunicorn master, whose handlers only queue signals for
+    # its own main loop; restore the defaults so SIGTERM stops the relay
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, signal.SIG_DFL)
+    listener = Listener(address, authkey=authkey)
+    connections = set()
+    lock = threading.Lock()
+
+    def pump(conn):
+        try:
+            while True:
+                message = conn.recv_bytes()
+                with lock:
+                    peers = [c for c in connections if c is not conn]
+                for peer in peers:
+                    try:
+                        peer.send_bytes(message)
+                    except (OSError, EOFError):
+                        with lock:
+                            connections.discard(peer)
+        except (OSError, EOFError):
+            pass
+        finally:
+            with lock:
+                connections.discard(conn)
+            conn.close()
+
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:  # failed handshake, e.g. wrong authkey
+            print(f"Event relay rejected a connection: {e}")
+            continue
+        with lock:
+            connections.add(conn)
+        threading.Thread(target=pump, args=(conn,), daemon=True).start()
+
+
+def broker_from_env():
+    """Build the worker's broker from EVENT_RELAY_* / SSE_* settings"""
+    authkey = os.getenv("EVENT_RELAY_AUTHKEY")
+    return EventBroker(
+        relay_address=os.getenv("EVENT_RELAY_ADDRESS") or None,
+        relay_authkey=bytes.fromhex(authkey) if authkey else None,
+        max_buffer_bytes=int(os.getenv("SSE_MAX_BUFFER_BYTES", 64 * 1024))
+    )
@@ -1,5 +1,7 @@
 # Gunicorn configuration for Render deployment
+import multiprocessing
 import os
+import tempfile
 
 # Bind to the port that Render provides, or default to 5000 for local development
 port = os.environ.get('PORT', 5000)
@@ -7,8 +9,12 @@ bind = f"0.0.0.0:{port}"
 
 # Worker configuration
 workers = 2
-worker_class = "sync"
-worker_connections = 1000
+# gevent workers: an open SSE stream is a greenlet waiting on the broker, not
+# an OS thread, so open streams don't starve other routes. main.py
+# caps streams per worker by memory (SSE_MEMORY_BUDGET_MB); keep
+# worker_connections well above that cap.
+worker_class = "gevent"
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
 timeout = 30
 keepalive = 2
 
@@ -18,4 +24,47 @@ errorlog = '-'
 loglevel = 'info'
 
 # Process naming
-proc_name = 'bolt-nexus-backend'
\ No newline at end of file
+proc_name = 'bolt-nexus-backend'
+
+# Event relay: lets SSE subscribers on one worker receive events published by
+# another (see events.py). Started once in the master before workers fork.
+def when_ready(server):
+    from events import run_relay
+
+    address = os.path.join(tempfile.gettempdir(), f"bolt-nexus-events-{os.getpid()}.sock")
+    authkey = os.urandom(16)
+    relay = multiprocessing.Process(target=run_relay, args=(address, authkey), daemon=True)
+    relay.start()
+    server.event_relay = relay
+
+    # Workers inherit these from the master's environment
+    os.environ['EVENT_RELAY_ADDRESS'] = address
+    os.environ['EVENT_RELAY_AUTHKEY'] = authkey.hex()
+    server.log.info(f"Event relay listening on {address}")
+
+
+def post_fork(server, worker):
+    # The relay is the master's child, but the worker inherits multiprocessing's
+    # record of it; drop that so the worker's exit hook doesn't try to join it
+    relay = getattr(server, 'event_relay', None)
+    if relay is not None:
+        multiprocessing.process._children.discard(relay)
+
+
+def post_worker_init(worker):
+    # Runs in each worker right after fork, once the app is loaded (post_fork
+    # would run before the import), so no thread or relay connection is made
+    # in the master or by importing main elsewhere
+    from main import start_worker_threads
+    start_worker_threads()
+
+
+def on_exit(server):
+    # Stop the relay before multiprocessing's atexit hook tries to join it
+    relay = getattr(server, 'event_relay', None)
+    if relay is not None and relay.is_alive():
+        relay.kill()
+        relay.join(5)
+    address = os.environ.get('EVENT_RELAY_ADDRESS')
+    if address and os.path.exists(address):
+        os.remove(address)
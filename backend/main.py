@@ -4,29 +4,80 @@ Flask Backend for Bolt Nexus - Smart Appliance Health Platform
 Handles diagnostics, booking, payments (Razorpay), and technician management.
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, after_this_request, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from supabase.client import create_client, Client
+from supabase.lib.client_options import ClientOptions
 import os
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 from decimal import Decimal
+import base64
 import hashlib
 import hmac
 import json
+import threading
+import time
+import httpx
+import msgspec
+from events import broker_from_env
+from profiling import SamplingProfiler, SlowRequestRecorder
+from resilience import CircuitOpenError, GuardedClient, StaleCache
+from routing import ReplicaRouter
+from schemas import (
+    BookingRequest, CompleteJobRequest, CreateOrderRequest, DiagnosticRequest,
+    RegisterRequest, VerifyPaymentRequest, decode
+)
+from webhooks import WebhookQueue, parse_payment_event, verify_signature
 
 # Load environment variables
 load_dotenv()
 
+# Request profiling: slow-request timelines are always kept, the sampling
+# profiler is opt-in (PROFILER_ENABLED=1)
+slow_requests = SlowRequestRecorder(threshold_ms=float(os.getenv("SLOW_REQUEST_MS", 1000)))
+profiler = SamplingProfiler(interval=float(os.getenv("PROFILER_INTERVAL_MS", 10)) / 1000)
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(__file__), "profiles"))
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Records how long jsonify spends serializing each response"""
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        result = super().dumps(obj, **kwargs)
+        slow_requests.add_span('serialize', 'json', started, time.perf_counter() - started)
+        return result
+
 # Initialize Flask app
 app = Flask(__name__)
-CORS(app)  # Enable CORS for React frontend
+app.json = TimedJSONProvider(app)
+CORS(app, expose_headers=['X-Read-Token', 'X-Data-Stale', 'X-Data-Age'])  # Enable CORS for React frontend
 
 # Initialize Supabase client
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# Service role key for maintenance functions that are not exposed to the anon key
+SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
+# Optional comma-separated read replica API URLs (same key as the primary)
+SUPABASE_REPLICA_URLS = [u.strip() for u in os.getenv("SUPABASE_REPLICA_URLS", "").split(",") if u.strip()]
 RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID", "rzp_test_dummy")
 RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET", "dummy_secret")
+RAZORPAY_WEBHOOK_SECRET = os.getenv("RAZORPAY_WEBHOOK_SECRET")
+WEBHOOK_RECOVER_AFTER_SECONDS = 120
+# Payments are verified shortly after the order is created; bounding lookups
+# by created_at keeps them on the newest monthly partitions
+PAYMENT_LOOKUP_DAYS = 30
+# Identical diagnostic submissions within this window return the stored result (0 disables)
+DIAGNOSTIC_DEDUP_WINDOW_MINUTES = int(os.getenv("DIAGNOSTIC_DEDUP_WINDOW_MINUTES", 30))
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY")
+# Fail fast instead of holding a worker until gunicorn's 30s timeout
+SUPABASE_TIMEOUT_SECONDS = float(os.getenv("SUPABASE_TIMEOUT_SECONDS", 3))
+BREAKER_OPTIONS = {
+    'failure_threshold': int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5)),
+    'slow_call_seconds': float(os.getenv("BREAKER_SLOW_CALL_SECONDS", 1.5)),
+    'cooldown_seconds': float(os.getenv("BREAKER_COOLDOWN_SECONDS", 15))
+}
 
 print("\n" + "="*50)
 print("Bolt Nexus Backend Initialization")
@@ -39,17 +90,69 @@ if not SUPABASE_URL or not SUPABASE_KEY:
     raise ValueError("Missing Supabase credentials. Check your .env file")
 
 try:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    options = ClientOptions(postgrest_client_timeout=SUPABASE_TIMEOUT_SECONDS)
+    supabase = GuardedClient(create_client(SUPABASE_URL, SUPABASE_KEY, options=options), 'primary', **BREAKER_OPTIONS)
     print("✓ Supabase client initialized successfully")
     
     # Test connection
     test_response = supabase.table("users").select("id").limit(1).execute()
     print(f"✓ Database connection test successful")
+    
+    if SUPABASE_SERVICE_KEY:
+        service_db = GuardedClient(create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY, options=options), 'service', **BREAKER_OPTIONS)
+    else:
+        service_db = None
+        print("⚠ SUPABASE_SERVICE_KEY not set: webhooks, partition upkeep and analytics refresh are disabled")
+    
+    # Make sure next months' partitions exist (no-op when pg_cron already did it)
+    try:
+        if service_db:
+            service_db.rpc('ensure_monthly_partitions', {}).execute()
+    except Exception as e:
+        print(f"⚠ Could not create monthly partitions: {str(e)}")
+    
+    replicas = [
+        GuardedClient(create_client(url, SUPABASE_KEY, options=options), f"replica{i}", **BREAKER_OPTIONS)
+        for i, url in enumerate(SUPABASE_REPLICA_URLS)
+    ]
+    router = ReplicaRouter(supabase, replicas)
+    
+    def record_db_call(table, operation, started, duration, failed):
+        slow_requests.add_span('db', f"{table}.{operation}", started, duration, failed=failed)
+    
+    for client in [supabase, service_db] + replicas:
+        if client:
+            client.observer = record_db_call
+    print(f"✓ Read replicas: {len(replicas)}")
     print("\n" + "="*50 + "\n")
 except Exception as e:
     print(f"✗ Failed to initialize Supabase: {str(e)}")
     raise
 
+# Technician app delta sync: page size, how far back each new sync re-reads
+# (covers transactions that commit late) and how long tokens stay valid
+# (matches the tombstone retention in purge_booking_tombstones)
+SYNC_PAGE_SIZE = 200
+SYNC_OVERLAP_SECONDS = 60
+SYNC_TOKEN_MAX_AGE_DAYS = 30
+
+# Last good responses of read endpoints, served (marked stale) during outages
+stale_cache = StaleCache(max_entries=int(os.getenv("STALE_CACHE_ENTRIES", 2000)))
+
+# Change events for SSE subscribers (technician app, user booking screens)
+broker = broker_from_env()
+SSE_HEARTBEAT_SECONDS = 15
+SSE_RETRY_MS = 3000
+# Under the gevent worker a stream is a greenlet, so the limit is memory: each
+# one may buffer up to SSE_MAX_BUFFER_BYTES plus its stack and socket state
+SSE_STREAM_OVERHEAD_BYTES = 16 * 1024
+SSE_MEMORY_BUDGET_BYTES = int(os.getenv("SSE_MEMORY_BUDGET_MB", 48)) * 1024 * 1024
+SSE_MAX_STREAMS = int(os.getenv(
+    "SSE_MAX_STREAMS", max(1, SSE_MEMORY_BUDGET_BYTES // (broker.max_buffer_bytes + SSE_STREAM_OVERHEAD_BYTES))
+))
+SSE_BUSY_RETRY_SECONDS = 30
+sse_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
 # Pricing configuration (in INR)
 PRICING = {
     'AC': {'one_time': 799, 'amc': 999},
@@ -145,6 +248,164 @@ def generate_recommendations(appliance_type, health_score, months_since_service)
     
     return recommendations
 
+def parse_body(schema):
+    """Decode and validate the JSON body; returns (data, error_response)"""
+    body = request.get_data()
+    if not body:
+        return None, (jsonify({"error": "No data provided"}), 400)
+    try:
+        return decode(schema, body), None
+    except msgspec.ValidationError as e:
+        return None, (jsonify({"error": f"Invalid request: {e}"}), 400)
+    except msgspec.DecodeError:
+        return None, (jsonify({"error": "Request body is not valid JSON"}), 400)
+
+def error_response(e):
+    """JSON error for a failed handler; database outages become a fast 503"""
+    if isinstance(e, CircuitOpenError):
+        response = jsonify({"error": "Service temporarily unavailable, please retry shortly"})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
+    if isinstance(e, httpx.TimeoutException):
+        return jsonify({"error": "Database timed out, please retry shortly"}), 503
+    return jsonify({"error": str(e)}), 500
+
+def cached_response(cache_key, data):
+    """Remember a good read response and return it"""
+    stale_cache.put(cache_key, data)
+    return jsonify(data)
+
+def stale_response(cache_key, e):
+    """Serve the last good response for a failed read, or the error"""
+    cached = stale_cache.get(cache_key)
+    if cached is None:
+        return error_response(e)
+    data, age = cached
+    response = jsonify(data)
+    response.headers['X-Data-Stale'] = 'true'
+    response.headers['X-Data-Age'] = str(int(age))
+    response.headers['Warning'] = '110 - "Response is Stale"'
+    return response
+
+def note_write(user_id=None, technician_id=None):
+    """Record a write so this user's/technician's next reads see it"""
+    keys = []
+    if user_id:
+        keys.append(f"user:{user_id}")
+    if technician_id:
+        keys.append(f"technician:{technician_id}")
+    token = router.note_write(keys)
+    
+    if token:
+        @after_this_request
+        def add_read_token(response):
+            # Clients send this back as X-Read-Token so any worker can honour it
+            response.headers['X-Read-Token'] = token
+            return response
+
+def read_client(key, *tables):
+    """Replica or primary client for a read endpoint that reads tables"""
+    return router.reader(key, request.headers.get('X-Read-Token'), tables)
+
+def publish_booking_event(event_type, booking):
+    """Push a booking change to the user's and technician's event streams"""
+    payload = {key: booking.get(key) for key in (
+        'id', 'user_id', 'technician_id', 'appliance_id', 'appliance_type', 'service_type',
+        'scheduled_date', 'status', 'payment_status', 'updated_at'
+    )}
+    try:
+        if booking.get('user_id'):
+            broker.publish(f"user:{booking['user_id']}", event_type, payload)
+        if booking.get('technician_id'):
+            broker.publish(f"technician:{booking['technician_id']}", event_type, payload)
+    except Exception as e:
+        # Subscribers resync on reconnect; never fail the write over an event
+        print(f"Failed to publish {event_type} for booking {booking.get('id')}: {e}")
+
+def event_stream(channels):
+    """Server-sent events response for the given broker channels"""
+    if not sse_slots.acquire(blocking=False):
+        response = jsonify({"error": "Too many open event streams, use /jobs/changes meanwhile"})
+        response.headers['Retry-After'] = str(SSE_BUSY_RETRY_SECONDS)
+        return response, 503
+    
+    def generate():
+        # Subscribed here, not before: if the client leaves before the first
+        # chunk the generator never runs and nothing is left subscribed
+        subscription = broker.subscribe(channels)
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            while True:
+                message = subscription.next(timeout=SSE_HEARTBEAT_SECONDS)
+                if message is not None:
+                    yield message
+                elif subscription.overflowed:
+                    # Client fell too far behind; tell it to refetch and reconnect
+                    yield "event: resync\ndata: {}\n\n"
+                    return
+                else:
+                    yield ": keepalive\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+    
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Runs when the server closes the response, whether or not it streamed
+    response.call_on_close(sse_slots.release)
+    return response
+
+def diagnostic_fingerprint(data):
+    """Stable hash of the fields that determine a diagnostic result"""
+    key = [
+        data.email.strip().lower(),
+        data.appliance_type,
+        (data.brand_model or '').strip().lower(),
+        data.year_of_purchase,
+        data.usage_hours_per_day,
+        data.months_since_service
+    ]
+    return hashlib.sha256(msgspec.json.encode(key)).hexdigest()
+
+# Request timing
+@app.before_request
+def start_request_timing():
+    slow_requests.start_request()
+    if PROFILER_ENABLED:
+        profiler.enter()
+
+@app.after_request
+def finish_request_timing(response):
+    # SSE streams stay open by design; they are not slow requests
+    if not response.is_streamed:
+        slow_requests.finish_request(request.method, request.path, response.status_code)
+    return response
+
+@app.teardown_request
+def stop_request_sampling(exc):
+    if PROFILER_ENABLED:
+        profiler.exit()
+
+def dump_profiles(tag):
+    """Write this worker's profile and slow requests under PROFILE_DIR"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    prefix = os.path.join(PROFILE_DIR, f"{tag}-{os.getpid()}")
+    written = {'slow_requests': slow_requests.dump(f"{prefix}-slow.json", f"{prefix}-slow.folded")}
+    if PROFILER_ENABLED:
+        written['stacks'] = profiler.dump_folded(f"{prefix}-cpu.folded")
+    print(f"Profiles written to {prefix}-*: {written}")
+    return written
+
+def on_profiler_event(event_type, data):
+    """Every worker dumps its own data when an admin asks (via the broker)"""
+    if event_type != 'dump':
+        return
+    try:
+        dump_profiles(data['tag'])
+    except OSError as e:
+        print(f"Failed to write profiles: {e}")
+
 # API Endpoints
 
 @app.route('/')
@@ -155,27 +416,27 @@ def root():
 @app.route('/api/register', methods=['POST'])
 def register_appliance():
     """Register appliance with probability-based maintenance analysis"""
-    data = request.json
-    if not data:
-        return jsonify({"error": "No data provided"}), 400
+    data, error = parse_body(RegisterRequest)
+    if error:
+        return error
     
     try:
         print(f"\n=== Registration Request ===")
         print(f"Data received: {data}")
         
         # Extract data
-        name = data.get('name')
-        phone = data.get('phone')
-        email = data.get('email')
-        city = data.get('city')
-        appliance_type = data.get('appliance_type')
-        brand_model = data.get('brand_model')
-        appliance_age_years = data.get('appliance_age_years', 2)
-        usage_hours = data.get('usage_hours_per_day')
-        months_since_service = data.get('months_since_service')
-        current_bill = data.get('current_bill', 3000)
-        maintenance_probability = data.get('maintenance_probability', 0)
-        estimated_savings = data.get('estimated_savings', 0)
+        name = data.name
+        phone = data.phone
+        email = data.email
+        city = data.city
+        appliance_type = data.appliance_type
+        brand_model = data.brand_model
+        appliance_age_years = data.appliance_age_years
+        usage_hours = data.usage_hours_per_day
+        months_since_service = data.months_since_service
+        current_bill = data.current_bill
+        maintenance_probability = data.maintenance_probability
+        estimated_savings = data.estimated_savings
         
         # Calculate year of purchase from age
         current_year = datetime.now().year
@@ -248,6 +509,7 @@ def register_appliance():
             
         appliance = appliance_response.data[0]
         print(f"Created appliance: {appliance['id']}")
+        note_write(user_id=user['id'])
         
         # Return response with probability and savings
         response_data = {
@@ -267,6 +529,8 @@ def register_appliance():
         print(f"=== End Registration ===")
         return jsonify(response_data), 200
         
+    except (CircuitOpenError, httpx.TimeoutException) as e:
+        return error_response(e)
     except Exception as e:
         print(f"\n!!! REGISTRATION ERROR !!!")
         print(f"Error type: {type(e).__name__}")
@@ -279,21 +543,46 @@ def register_appliance():
 @app.route('/api/diagnostic', methods=['POST'])
 def run_diagnostic():
     """Run free diagnostic for an appliance"""
-    data = request.json
-    if not data:
-        return jsonify({"error": "No data provided"}), 400
+    data, error = parse_body(DiagnosticRequest)
+    if error:
+        return error
     
     try:
+        fingerprint = diagnostic_fingerprint(data)
+        
+        # Resubmission / retry of the same form: return the stored result
+        if DIAGNOSTIC_DEDUP_WINDOW_MINUTES > 0:
+            since = datetime.utcnow() - timedelta(minutes=DIAGNOSTIC_DEDUP_WINDOW_MINUTES)
+            previous = supabase.table("diagnostics").select("*").eq(
+                "input_fingerprint", fingerprint
+            ).gte("created_at", since.isoformat() + "Z").order(
+                "created_at", desc=True
+            ).limit(1).execute()
+            
+            if previous.data:
+                diagnostic = previous.data[0]
+                return jsonify({
+                    'user_id': diagnostic['user_id'],
+                    'appliance_id': diagnostic['appliance_id'],
+                    'diagnostic_id': diagnostic['id'],
+                    'health_score': diagnostic['health_score'],
+                    'energy_loss_per_month': float(diagnostic['energy_loss_per_month']),
+                    'estimated_savings': round(float(diagnostic['estimated_savings']), 2),
+                    'recommendations': (diagnostic['recommendations'] or '').split('\n'),
+                    'pricing': PRICING.get(data.appliance_type, PRICING['AC']),
+                    'deduplicated': True
+                }), 200
+        
         # Extract data
-        name = data.get('name')
-        phone = data.get('phone')
-        email = data.get('email')
-        city = data.get('city')
-        appliance_type = data.get('appliance_type')
-        brand_model = data.get('brand_model')
-        year_of_purchase = data.get('year_of_purchase')
-        usage_hours = data.get('usage_hours_per_day')
-        months_since_service = data.get('months_since_service')
+        name = data.name
+        phone = data.phone
+        email = data.email
+        city = data.city
+        appliance_type = data.appliance_type
+        brand_model = data.brand_model
+        year_of_purchase = data.year_of_purchase
+        usage_hours = data.usage_hours_per_day
+        months_since_service = data.months_since_service
         
         # Create or get user
         user_response = supabase.table("users").select("*").eq("email", email).execute()
@@ -354,10 +643,12 @@ def run_diagnostic():
             'health_score': health_score,
             'energy_loss_per_month': energy_loss,
             'estimated_savings': estimated_savings,
-            'recommendations': '\n'.join(recommendations)
+            'recommendations': '\n'.join(recommendations),
+            'input_fingerprint': fingerprint
         }
         diagnostic_response = supabase.table("diagnostics").insert(diagnostic_data).execute()
         diagnostic = diagnostic_response.data[0]
+        note_write(user_id=user['id'])
         
         return jsonify({
             'user_id': user['id'],
@@ -371,41 +662,43 @@ def run_diagnostic():
         }), 201
         
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return error_response(e)
 
 # User endpoints
 @app.route('/api/users/<int:user_id>', methods=['GET'])
 def get_user(user_id):
     try:
-        response = supabase.table("users").select("*").eq("id", user_id).execute()
+        response = read_client(f"user:{user_id}", "users").table("users").select("*").eq("id", user_id).execute()
         if not response.data:
             return jsonify({"error": "User not found"}), 404
         return jsonify(response.data[0])
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return error_response(e)
 
 # Appliance endpoints
 @app.route('/api/appliances/<int:user_id>', methods=['GET'])
 def get_user_appliances(user_id):
     """Get all appliances for a user"""
     try:
-        response = supabase.table("appliances").select("*").eq("user_id", user_id).order(
+        response = read_client(f"user:{user_id}", "appliances").table("appliances").select("*").eq("user_id", user_id).order(
             "created_at", desc=True
         ).execute()
-        return jsonify(response.data)
+        return cached_response(f"appliances:{user_id}", response.data)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return stale_response(f"appliances:{user_id}", e)
 
 # Dashboard endpoint
 @app.route('/api/dashboard/<int:user_id>', methods=['GET'])
 def get_dashboard(user_id):
     """Get dashboard data for user"""
     try:
+        db = read_client(f"user:{user_id}", "appliances", "bookings")
+        
         # Get user appliances with diagnostics
-        appliances = supabase.table("appliances").select("*").eq("user_id", user_id).execute()
+        appliances = db.table("appliances").select("*").eq("user_id", user_id).execute()
         
         # Get recent bookings
-        bookings = supabase.table("bookings").select(
+        bookings = db.table("bookings").select(
             "*, appliances(appliance_type)"
         ).eq("user_id", user_id).order("created_at", desc=True).limit(5).execute()
         
@@ -415,28 +708,28 @@ def get_dashboard(user_id):
         # Count appliances by status
         needs_service = sum(1 for a in appliances.data if a.get('health_score', 100) < 60)
         
-        return jsonify({
+        return cached_response(f"dashboard:{user_id}", {
             'appliances': appliances.data,
             'bookings': bookings.data,
             'total_potential_savings': round(total_savings, 2),
             'appliances_needing_service': needs_service
         })
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return stale_response(f"dashboard:{user_id}", e)
 
 # Booking endpoints
 @app.route('/api/bookings', methods=['POST'])
 def create_booking():
     """Create a service booking"""
-    data = request.json
-    if not data:
-        return jsonify({"error": "No data provided"}), 400
+    data, error = parse_body(BookingRequest)
+    if error:
+        return error
     
     try:
-        user_id = data.get('user_id')
-        appliance_id = data.get('appliance_id')
-        service_type = data.get('service_type')  # 'one_time' or 'amc'
-        scheduled_date = data.get('scheduled_date')
+        user_id = data.user_id
+        appliance_id = data.appliance_id
+        service_type = data.service_type  # 'one_time' or 'amc'
+        scheduled_date = data.scheduled_date
         
         # Get appliance details
         appliance = supabase.table("appliances").select("*").eq("id", appliance_id).execute()
@@ -470,6 +763,8 @@ def create_booking():
         
         response = supabase.table("bookings").insert(booking_data).execute()
         booking = response.data[0]
+        note_write(user_id=booking['user_id'], technician_id=booking['technician_id'])
+        publish_booking_event('booking.created', booking)
         
         return jsonify({
             'booking': booking,
@@ -478,30 +773,30 @@ def create_booking():
         }), 201
         
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return error_response(e)
 
 @app.route('/api/bookings/<int:user_id>', methods=['GET'])
 def get_user_bookings(user_id):
     """Get all bookings for a user"""
     try:
-        response = supabase.table("bookings").select(
+        response = read_client(f"user:{user_id}", "bookings").table("bookings").select(
             "*, appliances(appliance_type, brand_model), technicians(name, phone)"
         ).eq("user_id", user_id).order("created_at", desc=True).execute()
-        return jsonify(response.data)
+        return cached_response(f"bookings:{user_id}", response.data)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return stale_response(f"bookings:{user_id}", e)
 
 # Payment endpoints
 @app.route('/api/payments/create-order', methods=['POST'])
 def create_payment_order():
     """Create Razorpay order"""
-    data = request.json
-    if not data:
-        return jsonify({"error": "No data provided"}), 400
+    data, error = parse_body(CreateOrderRequest)
+    if error:
+        return error
     
     try:
-        booking_id = data.get('booking_id')
-        amount = data.get('amount')  # in INR
+        booking_id = data.booking_id
+        amount = data.amount  # in INR
         
         # In production, you'd use Razorpay SDK here
         # For MVP, we'll simulate order creation
@@ -510,7 +805,7 @@ def create_payment_order():
         # Create payment record
         payment_data = {
             'booking_id': booking_id,
-            'user_id': data.get('user_id'),
+            'user_id': data.user_id,
             'razorpay_order_id': order_id,
             'amount': amount,
             'currency': 'INR',
@@ -518,6 +813,7 @@ def create_payment_order():
         }
         
         response = supabase.table("payments").insert(payment_data).execute()
+        note_write(user_id=data.user_id)
         
         return jsonify({
             'order_id': order_id,
@@ -528,46 +824,55 @@ def create_payment_order():
         }), 201
         
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return error_response(e)
 
 @app.route('/api/payments/verify', methods=['POST'])
 def verify_payment():
     """Verify Razorpay payment signature"""
-    data = request.json
-    if not data:
-        return jsonify({"error": "No data provided"}), 400
+    data, error = parse_body(VerifyPaymentRequest)
+    if error:
+        return error
     
     try:
-        payment_id = data.get('payment_id')
-        order_id = data.get('razorpay_order_id')
-        signature = data.get('razorpay_signature')
-        razorpay_payment_id = data.get('razorpay_payment_id')
-        booking_id = data.get('booking_id')
+        order_id = data.razorpay_order_id
+        signature = data.razorpay_signature
+        razorpay_payment_id = data.razorpay_payment_id
         
-        # In production, verify signature with Razorpay
-        # For MVP, we'll simulate successful payment
+        # Razorpay signs "<order_id>|<payment_id>" with the key secret
+        message = f"{order_id}|{razorpay_payment_id}".encode()
+        if not verify_signature(message, signature, RAZORPAY_KEY_SECRET):
+            return jsonify({"error": "Invalid payment signature"}), 400
         
-        # Update payment record
-        supabase.table("payments").update({
+        # Update payment record (looked up by the signed order id, not client ids)
+        payment = supabase.table("payments").update({
             'razorpay_payment_id': razorpay_payment_id,
             'razorpay_signature': signature,
             'status': 'success',
             'updated_at': datetime.now().isoformat()
-        }).eq('id', payment_id).execute()
+        }).eq('razorpay_order_id', order_id).gte(
+            'created_at', (datetime.utcnow() - timedelta(days=PAYMENT_LOOKUP_DAYS)).isoformat() + "Z"
+        ).execute()
+        
+        if not payment.data:
+            return jsonify({"error": "Payment not found"}), 404
+        
+        booking_id = payment.data[0]['booking_id']
         
         # Update booking status
-        supabase.table("bookings").update({
+        booking = supabase.table("bookings").update({
             'payment_status': 'paid',
             'status': 'confirmed',
             'updated_at': datetime.now().isoformat()
         }).eq('id', booking_id).execute()
         
         # Update appliance status
-        booking = supabase.table("bookings").select("appliance_id").eq("id", booking_id).execute()
         if booking.data:
             supabase.table("appliances").update({
                 'status': 'service_scheduled'
             }).eq('id', booking.data[0]['appliance_id']).execute()
+            # After the last write, so the read token covers the appliance too
+            note_write(user_id=booking.data[0]['user_id'], technician_id=booking.data[0]['technician_id'])
+            publish_booking_event('booking.confirmed', booking.data[0])
         
         return jsonify({
             'success': True,
@@ -575,7 +880,88 @@ def verify_payment():
         }), 200
         
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return error_response(e)
+
+def apply_payment_events(events):
+    """Apply a batch of queued webhook events in one database call"""
+    response = service_db.rpc('apply_payment_events', {'events': events}).execute()
+    
+    # One LSN lookup for the whole batch
+    keys = set()
+    for booking in response.data:
+        if booking['user_id']:
+            keys.add(f"user:{booking['user_id']}")
+        if booking['technician_id']:
+            keys.add(f"technician:{booking['technician_id']}")
+    if keys:
+        router.note_write(sorted(keys))
+    
+    for booking in response.data:
+        event_type = 'booking.confirmed' if booking['payment_status'] == 'paid' else 'booking.payment_failed'
+        publish_booking_event(event_type, booking)
+
+def dead_letter_payment_events(events, error):
+    """Park events that keep failing; set state back to 'pending' to retry them"""
+    service_db.table('payment_webhook_events').update({
+        'state': 'dead',
+        'last_error': str(error)[:1000]
+    }).in_('event_id', [event['event_id'] for event in events]).eq('state', 'pending').execute()
+
+def load_pending_payment_events():
+    """Stored events not applied yet, e.g. queued on a worker that was killed"""
+    # Younger events are most likely still queued on the worker that stored them
+    cutoff = datetime.utcnow() - timedelta(seconds=WEBHOOK_RECOVER_AFTER_SECONDS)
+    response = service_db.table('payment_webhook_events').select('event').eq(
+        'state', 'pending'
+    ).lt('received_at', cutoff.isoformat()).order('received_at').limit(500).execute()
+    return [row['event'] for row in response.data]
+
+payment_events = WebhookQueue(
+    apply_payment_events,
+    dead_letter=dead_letter_payment_events,
+    load_pending=load_pending_payment_events
+)
+
+@app.route('/api/payments/webhook', methods=['POST'])
+def payment_webhook():
+    """Razorpay webhook: verify, store, enqueue and acknowledge"""
+    body = request.get_data()
+    signature = request.headers.get('X-Razorpay-Signature')
+    if not verify_signature(body, signature, RAZORPAY_WEBHOOK_SECRET):
+        return jsonify({"error": "Invalid webhook signature"}), 400
+    
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return jsonify({"error": "Invalid JSON"}), 400
+    
+    event = parse_payment_event(payload, request.headers.get('X-Razorpay-Event-Id'))
+    if event is None:
+        return jsonify({'status': 'ignored'}), 200
+    
+    if service_db is None:
+        # Non-2xx makes Razorpay retry once the key is configured
+        return jsonify({"error": "Webhooks need SUPABASE_SERVICE_KEY"}), 503
+    
+    try:
+        # Stored before acknowledging: Razorpay does not retry after a 2xx
+        stored = service_db.table('payment_webhook_events').upsert({
+            'event_id': event['event_id'],
+            'event_type': event['event_type'],
+            'razorpay_order_id': event['order_id'],
+            'event': event
+        }, on_conflict='event_id', ignore_duplicates=True).execute()
+    except Exception as e:
+        print(f"Failed to store webhook {event['event_id']}: {e}")
+        # Non-2xx makes Razorpay retry later
+        return jsonify({"error": "Webhook could not be stored"}), 503
+    
+    if not stored.data:
+        return jsonify({'status': 'duplicate'}), 200
+    
+    # A full queue is fine: the stored event is picked up by recovery
+    payment_events.enqueue(event)
+    return jsonify({'status': 'queued'}), 200
 
 # Technician dashboard
 @app.route('/api/technician/<int:technician_id>/jobs', methods=['GET'])
@@ -584,7 +970,7 @@ def get_technician_jobs(technician_id):
     try:
         status_filter = request.args.get('status', 'all')
         
-        query = supabase.table("bookings").select(
+        query = read_client(f"technician:{technician_id}", "bookings").table("bookings").select(
             "*, users(name, phone, email, city), appliances(appliance_type, brand_model)"
         ).eq("technician_id", technician_id)
         
@@ -595,18 +981,82 @@ def get_technician_jobs(technician_id):
         
         return jsonify(response.data)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return error_response(e)
+
+def encode_sync_token(updated_at, booking_id):
+    return base64.urlsafe_b64encode(f"{updated_at}|{booking_id}".encode()).decode()
+
+def decode_sync_token(token):
+    """(datetime, booking_id); raises ValueError on a malformed token"""
+    try:
+        updated_at, booking_id = base64.urlsafe_b64decode(token.encode()).decode().split('|')
+        return datetime.fromisoformat(updated_at), int(booking_id)
+    except (TypeError, UnicodeDecodeError, base64.binascii.Error) as e:
+        raise ValueError(str(e))
+
+@app.route('/api/technician/<int:technician_id>/jobs/changes', methods=['GET'])
+def get_technician_job_changes(technician_id):
+    """Bookings changed or removed since ?since=<token> (all jobs without a token)"""
+    token = request.args.get('since')
+    since_at, since_id = None, 0
+    if token:
+        try:
+            since_at, since_id = decode_sync_token(token)
+        except ValueError:
+            return jsonify({"error": "Invalid sync token", "resync": True}), 400
+        if since_at < datetime.now(since_at.tzinfo) - timedelta(days=SYNC_TOKEN_MAX_AGE_DAYS):
+            # Tombstones this old have been purged; start over without a token
+            return jsonify({"error": "Sync token expired", "resync": True}), 410
+    
+    try:
+        params = {'tech_id': technician_id, 'since_id': since_id, 'max_rows': SYNC_PAGE_SIZE}
+        if since_at:
+            params['since_at'] = since_at.isoformat()
+        # Always the primary: the next token is derived from its clock, and a
+        # lagging replica would hand out a cursor past rows it hasn't replayed
+        response = supabase.rpc('technician_job_changes', params).execute()
+        
+        changes = response.data['changes']
+        has_more = len(changes) == SYNC_PAGE_SIZE
+        if has_more:
+            # Continue exactly after the last row of this page
+            next_token = encode_sync_token(changes[-1]['updated_at'], changes[-1]['id'])
+        else:
+            server_time = datetime.fromisoformat(response.data['server_time'])
+            next_token = encode_sync_token(
+                (server_time - timedelta(seconds=SYNC_OVERLAP_SECONDS)).isoformat(), 0
+            )
+        
+        return jsonify({
+            'changes': changes,
+            'removed': response.data['removed'],
+            'full': token is None,
+            'has_more': has_more,
+            'token': next_token
+        })
+    except Exception as e:
+        return error_response(e)
+
+@app.route('/api/technician/<int:technician_id>/events', methods=['GET'])
+def technician_events(technician_id):
+    """Stream job assignments and status changes for a technician (SSE)"""
+    return event_stream([f"technician:{technician_id}"])
+
+@app.route('/api/users/<int:user_id>/events', methods=['GET'])
+def user_booking_events(user_id):
+    """Stream booking status changes for a user (SSE)"""
+    return event_stream([f"user:{user_id}"])
 
 @app.route('/api/technician/jobs/<int:job_id>/complete', methods=['POST'])
 def complete_job(job_id):
     """Mark job as completed and add service notes"""
-    data = request.json
-    if not data:
-        return jsonify({"error": "No data provided"}), 400
+    data, error = parse_body(CompleteJobRequest)
+    if error:
+        return error
     
     try:
         # Update booking status
-        supabase.table("bookings").update({
+        booking = supabase.table("bookings").update({
             'status': 'completed',
             'updated_at': datetime.now().isoformat()
         }).eq('id', job_id).execute()
@@ -614,16 +1064,15 @@ def complete_job(job_id):
         # Add service notes
         notes_data = {
             'booking_id': job_id,
-            'technician_id': data.get('technician_id'),
-            'notes': data.get('notes'),
-            'parts_replaced': data.get('parts_replaced'),
-            'verified_savings': data.get('verified_savings')
+            'technician_id': data.technician_id,
+            'notes': data.notes,
+            'parts_replaced': data.parts_replaced,
+            'verified_savings': data.verified_savings
         }
         
         supabase.table("service_notes").insert(notes_data).execute()
         
         # Update appliance status and health score
-        booking = supabase.table("bookings").select("appliance_id").eq("id", job_id).execute()
         if booking.data:
             supabase.table("appliances").update({
                 'status': 'serviced',
@@ -631,6 +1080,9 @@ def complete_job(job_id):
                 'months_since_service': 0,
                 'updated_at': datetime.now().isoformat()
             }).eq('id', booking.data[0]['appliance_id']).execute()
+            # After the last write, so the read token covers the appliance too
+            note_write(user_id=booking.data[0]['user_id'], technician_id=booking.data[0]['technician_id'])
+            publish_booking_event('booking.completed', booking.data[0])
         
         return jsonify({
             'success': True,
@@ -638,9 +1090,188 @@ def complete_job(job_id):
         }), 200
         
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return error_response(e)
+
+# Admin analytics (reads the daily rollup tables, see database/setup.sql)
+def is_admin_request():
+    """Check the X-Admin-Key header against ADMIN_API_KEY"""
+    supplied = request.headers.get('X-Admin-Key', '')
+    # Compare bytes: compare_digest rejects non-ASCII str
+    return bool(ADMIN_API_KEY) and hmac.compare_digest(supplied.encode(), ADMIN_API_KEY.encode())
+
+def analytics_date_range():
+    """Parse ?from=YYYY-MM-DD&to=YYYY-MM-DD, defaulting to the last 30 days"""
+    today = datetime.now().date()
+    date_to = request.args.get('to') or today.isoformat()
+    date_from = request.args.get('from') or (today - timedelta(days=29)).isoformat()
+    # Raises ValueError on malformed dates or an inverted/oversized range
+    start = datetime.strptime(date_from, '%Y-%m-%d')
+    end = datetime.strptime(date_to, '%Y-%m-%d')
+    if start > end or (end - start).days > 366:
+        raise ValueError("Invalid date range")
+    return date_from, date_to
+
+@app.route('/api/admin/analytics/refresh', methods=['POST'])
+def refresh_analytics():
+    """Re-aggregate the days touched since the last refresh"""
+    if not is_admin_request():
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    if service_db is None:
+        return jsonify({"error": "Analytics refresh needs SUPABASE_SERVICE_KEY"}), 503
+    
+    try:
+        full_refresh = request.args.get('full') == 'true'
+        response = service_db.rpc('refresh_analytics_rollups', {'full_refresh': full_refresh}).execute()
+        return jsonify({
+            'success': True,
+            'days_refreshed': response.data
+        })
+    except Exception as e:
+        return error_response(e)
+
+@app.route('/api/admin/analytics/revenue', methods=['GET'])
+def get_revenue_analytics():
+    """Daily revenue and payment outcomes"""
+    if not is_admin_request():
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    try:
+        date_from, date_to = analytics_date_range()
+    except ValueError:
+        return jsonify({"error": "from/to must be YYYY-MM-DD and at most a year apart"}), 400
+    
+    try:
+        response = supabase.table("analytics_daily_revenue").select("*").gte(
+            "day", date_from
+        ).lte("day", date_to).order("day").execute()
+        
+        days = response.data
+        succeeded = sum(d['payments_succeeded'] for d in days)
+        created = sum(d['payments_created'] for d in days)
+        
+        return jsonify({
+            'from': date_from,
+            'to': date_to,
+            'days': days,
+            'total_revenue': round(sum(float(d['revenue']) for d in days), 2),
+            'payments_created': created,
+            'payments_succeeded': succeeded,
+            'success_rate': round(succeeded / created, 4) if created else None
+        })
+    except Exception as e:
+        return error_response(e)
+
+@app.route('/api/admin/analytics/funnel', methods=['GET'])
+def get_funnel_analytics():
+    """Diagnostic -> booking -> paid conversion"""
+    if not is_admin_request():
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    try:
+        date_from, date_to = analytics_date_range()
+    except ValueError:
+        return jsonify({"error": "from/to must be YYYY-MM-DD and at most a year apart"}), 400
+    
+    try:
+        response = supabase.table("analytics_daily_funnel").select("*").gte(
+            "day", date_from
+        ).lte("day", date_to).order("day").execute()
+        
+        days = response.data
+        diagnostics = sum(d['diagnostics'] for d in days)
+        bookings = sum(d['bookings'] for d in days)
+        paid = sum(d['paid_bookings'] for d in days)
+        
+        return jsonify({
+            'from': date_from,
+            'to': date_to,
+            'days': days,
+            'diagnostics': diagnostics,
+            'bookings': bookings,
+            'paid_bookings': paid,
+            'diagnostic_to_booking': round(bookings / diagnostics, 4) if diagnostics else None,
+            'booking_to_paid': round(paid / bookings, 4) if bookings else None
+        })
+    except Exception as e:
+        return error_response(e)
+
+@app.route('/api/admin/analytics/bookings', methods=['GET'])
+def get_booking_analytics():
+    """Bookings per city and technician"""
+    if not is_admin_request():
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    try:
+        date_from, date_to = analytics_date_range()
+    except ValueError:
+        return jsonify({"error": "from/to must be YYYY-MM-DD and at most a year apart"}), 400
+    
+    try:
+        response = supabase.rpc('analytics_bookings_summary', {
+            'date_from': date_from,
+            'date_to': date_to,
+            'filter_city': request.args.get('city')
+        }).execute()
+        
+        by_city = [r for r in response.data if r['dimension'] == 'city']
+        by_technician = [r for r in response.data if r['dimension'] == 'technician']
+        for row in by_city:
+            del row['dimension'], row['technician_id']
+        for row in by_technician:
+            del row['dimension'], row['city']
+        
+        return jsonify({
+            'from': date_from,
+            'to': date_to,
+            'by_city': by_city,
+            'by_technician': by_technician
+        })
+    except Exception as e:
+        return error_response(e)
+
+# Profiling (admin)
+@app.route('/api/admin/profiler/slow-requests', methods=['GET'])
+def get_slow_requests():
+    """Recent slow request timelines recorded by this worker"""
+    if not is_admin_request():
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    return jsonify({
+        'pid': os.getpid(),
+        'threshold_ms': slow_requests.threshold_ms,
+        'requests': slow_requests.entries()
+    })
+
+@app.route('/api/admin/profiler/dump', methods=['POST'])
+def dump_profiler():
+    """Ask every worker to write folded stacks and slow-request timelines"""
+    if not is_admin_request():
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    tag = datetime.now().strftime('%Y%m%d-%H%M%S')
+    broker.publish('admin:profiler', 'dump', {'tag': tag})
+    
+    return jsonify({
+        'success': True,
+        'directory': PROFILE_DIR,
+        'tag': tag,
+        'profiler_enabled': PROFILER_ENABLED,
+        'message': f"Workers are writing {tag}-<pid>-*.folded/json (render with flamegraph.pl or speedscope)"
+    }), 202
+
+def start_worker_threads():
+    """Background work for this process; gunicorn.conf.py calls it in each worker
+    (post_worker_init, i.e. after fork and once the app is loaded)"""
+    # Applies queued webhooks and recovers stored ones even before any arrive here
+    if service_db:
+        payment_events.start()
+    broker.add_listener('admin:profiler', on_profiler_event)
+    if PROFILER_ENABLED:
+        profiler.start()
 
 if __name__ == '__main__':
+    start_worker_threads()
     # Use Render's PORT environment variable if available, otherwise default to 5000
     port = int(os.environ.get('PORT', 5000))
     app.run(debug=True, host='0.0.0.0', port=port)
@@ -0,0 +1,160 @@
+"""
+Request profiling for Bolt Nexus.
+
+SamplingProfiler periodically samples the stacks of threads that are
+handling a request and aggregates them as folded stacks (the input format of
+flamegraph.pl / speedscope). SlowRequestRecorder keeps a timeline of each
+request (Supabase calls, JSON serialization, handler time) and retains the
+ones slower than a threshold. Both dump to local files on demand.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+
+try:
+    from greenlet import getcurrent
+except ImportError:  # installed with gevent; plain threads don't need it
+    getcurrent = None
+
+_timeline = ContextVar('request_timeline', default=None)
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples active request threads (or gevent greenlets) every interval seconds"""
+
+    def __init__(self, interval=0.01, max_stacks=20000):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.samples = 0
+        self._stacks = Counter()
+        self._active = {}  # ident -> greenlet handling the request
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def enter(self):
+        """Mark the calling thread as handling a request"""
+        with self._lock:
+            self._active[threading.get_ident()] = getcurrent() if getcurrent else None
+
+    def exit(self):
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active.items())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for ident, task in active:
+                frame = frames.get(ident)
+                if frame is None and task is not None:
+                    # gevent worker: requests are greenlets, suspended while
+                    # this one runs, so their saved frame is where they wait
+                    frame = task.gr_frame
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                if not stack:
+                    continue
+                key = ';'.join(reversed(stack))
+                with self._lock:
+                    if key in self._stacks or len(self._stacks) < self.max_stacks:
+                        self._stacks[key] += 1
+                    self.samples += 1
+
+    def dump_folded(self, path):
+        """Write 'frame;frame;frame count' lines; returns the number of stacks"""
+        with self._lock:
+            stacks = list(self._stacks.items())
+        with open(path, 'w') as f:
+            for stack, count in stacks:
+                f.write(f"{stack} {count}\n")
+        return len(stacks)
+
+
+class SlowRequestRecorder:
+    """Per-request timelines, keeping the ones above threshold_ms"""
+
+    def __init__(self, threshold_ms=1000, max_entries=200):
+        self.threshold_ms = threshold_ms
+        self._entries = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+
+    def start_request(self):
+        _timeline.set({'started': time.perf_counter(), 'spans': []})
+
+    def add_span(self, kind, name, started, duration, **extra):
+        """Record a span in the current request, if there is one"""
+        timeline = _timeline.get()
+        if timeline is None:
+            return
+        timeline['spans'].append(dict({
+            'kind': kind,
+            'name': name,
+            'start_ms': round((started - timeline['started']) * 1000, 2),
+            'duration_ms': round(duration * 1000, 2)
+        }, **extra))
+
+    def finish_request(self, method, path, status):
+        timeline = _timeline.get()
+        _timeline.set(None)
+        if timeline is None:
+            return
+        total_ms = (time.perf_counter() - timeline['started']) * 1000
+        if total_ms < self.threshold_ms:
+            return
+
+        spans = timeline['spans']
+        db_ms = sum(s['duration_ms'] for s in spans if s['kind'] == 'db')
+        serialize_ms = sum(s['duration_ms'] for s in spans if s['kind'] == 'serialize')
+        with self._lock:
+            self._entries.append({
+                'method': method,
+                'path': path,
+                'status': status,
+                'at': time.time(),
+                'duration_ms': round(total_ms, 2),
+                'db_ms': round(db_ms, 2),
+                'serialize_ms': round(serialize_ms, 2),
+                'handler_ms': round(total_ms - db_ms - serialize_ms, 2),
+                'spans': spans
+            })
+
+    def entries(self):
+        with self._lock:
+            return list(self._entries)
+
+    def dump(self, json_path, folded_path):
+        """Write the raw timelines and a folded-stack view weighted in ms"""
+        entries = self.entries()
+        with open(json_path, 'w') as f:
+            json.dump(entries, f, indent=2)
+
+        folded = Counter()
+        for entry in entries:
+            root = f"{entry['method']} {entry['path']}"
+            for span in entry['spans']:
+                folded[f"{root};{span['kind']} {span['name']}"] += span['duration_ms']
+            folded[f"{root};handler"] += max(entry['handler_ms'], 0)
+        with open(folded_path, 'w') as f:
+            for stack, ms in folded.items():
+                f.write(f"{stack} {max(1, round(ms))}\n")
+        return len(entries)
@@ -0,0 +1,109 @@
+"""
+Replay Razorpay webhooks against a local backend
+Signs each event with RAZORPAY_WEBHOOK_SECRET and posts it to
+/api/payments/webhook, re-sending a share of them to exercise deduplication.
+
+Usage:
+    python replay_webhooks.py order_abc order_def          # synthetic payment.captured events
+    python replay_webhooks.py --file recorded.jsonl        # one webhook body per line
+    python replay_webhooks.py --duplicates 3 --url http://localhost:5000 order_abc
+"""
+
+import argparse
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from dotenv import load_dotenv
+
+from webhooks import sign
+
+# Load environment variables
+load_dotenv()
+
+
+def captured_event(order_id):
+    """Minimal payment.captured body as Razorpay sends it"""
+    return {
+        'entity': 'event',
+        'event': 'payment.captured',
+        'payload': {
+            'payment': {
+                'entity': {
+                    'id': f"pay_{uuid.uuid4().hex[:14]}",
+                    'order_id': order_id,
+                    'status': 'captured',
+                    'method': 'upi'
+                }
+            }
+        },
+        'created_at': int(time.time())
+    }
+
+
+def post(url, body, secret, event_id):
+    request = urllib.request.Request(url, data=body, method='POST', headers={
+        'Content-Type': 'application/json',
+        'X-Razorpay-Signature': sign(body, secret),
+        'X-Razorpay-Event-Id': event_id
+    })
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            status, reply = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, reply = e.code, e.read()
+    return status, reply, (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay signed Razorpay webhooks")
+    parser.add_argument('order_ids', nargs='*', help="razorpay_order_id values to capture")
+    parser.add_argument('--file', help="JSONL file of recorded webhook bodies")
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--duplicates', type=int, default=1, help="times to send each event")
+    args = parser.parse_args()
+
+    secret = os.getenv("RAZORPAY_WEBHOOK_SECRET")
+    if not secret:
+        print("❌ RAZORPAY_WEBHOOK_SECRET not set in .env")
+        exit(1)
+
+    if args.file:
+        with open(args.file) as f:
+            events = [json.loads(line) for line in f if line.strip()]
+    else:
+        events = [captured_event(order_id) for order_id in args.order_ids]
+
+    if not events:
+        parser.error("give order ids or --file")
+
+    url = args.url.rstrip('/') + '/api/payments/webhook'
+    timings = []
+    statuses = {}
+
+    for event in events:
+        body = json.dumps(event).encode()
+        event_id = f"evt_{uuid.uuid4().hex[:14]}"
+        for _ in range(args.duplicates):
+            status, reply, elapsed = post(url, body, secret, event_id)
+            timings.append(elapsed)
+            try:
+                key = f"{status} {json.loads(reply).get('status', '')}".strip()
+            except ValueError:
+                key = str(status)
+            statuses[key] = statuses.get(key, 0) + 1
+
+    timings.sort()
+    print(f"\nSent {len(timings)} webhooks ({len(events)} unique) to {url}")
+    for key, count in sorted(statuses.items()):
+        print(f"   {key}: {count}")
+    print(f"   ack p50: {timings[len(timings) // 2]:.1f} ms")
+    print(f"   ack p99: {timings[min(len(timings) - 1, int(len(timings) * 0.99))]:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""
+Circuit breakers and last-known-good cache for Bolt Nexus.
+
+Every Supabase call goes through a GuardedClient, which keeps one breaker
+per (client, table). Timeouts, transport errors, server-side errors and slow
+calls open the breaker (errors caused by bad input do not); while it is open,
+calls fail immediately with CircuitOpenError instead of waiting on a
+struggling database. Read endpoints fall back to a bounded cache of their
+last good responses.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+import httpx
+from postgrest.exceptions import APIError
+
+WRITE_OPERATIONS = ('insert', 'update', 'upsert', 'delete')
+
+# SQLSTATE classes PostgREST reports as server-side trouble (connection,
+# resources, statement timeout/shutdown, system and internal errors)
+SERVER_ERROR_SQLSTATES = ('08', '53', '57', '58', 'XX')
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"Database circuit for {name} is open")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def is_server_failure(error):
+    """Whether an error says the database is unhealthy (not that the request was bad)"""
+    if isinstance(error, httpx.TransportError):  # includes timeouts
+        return True
+    if isinstance(error, APIError):
+        code = str(error.code or '')
+        if code.isdigit() and len(code) == 3:
+            # A non-JSON error page (e.g. a gateway 502/503/504): postgrest
+            # puts the HTTP status in code (SQLSTATEs have five characters)
+            return int(code) >= 500
+        # No code at all: an error body we can't classify, assume the worst
+        # PGRST0xx: PostgREST could not reach or query the database
+        return not code or code.startswith('PGRST0') or code.startswith(SERVER_ERROR_SQLSTATES)
+    return False
+
+
+class CircuitBreaker:
+    """closed -> open after too many failures/slow calls -> half-open trial"""
+
+    def __init__(self, name, failure_threshold=5, slow_call_seconds=1.5, window_seconds=30, cooldown_seconds=15):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.window_seconds = window_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.state = 'closed'
+        self._failures = deque()
+        self._opened_at = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through now"""
+        with self._lock:
+            if self.state == 'closed':
+                return
+            remaining = self._opened_at + self.cooldown_seconds - time.monotonic()
+            if self.state == 'open' and remaining <= 0:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._trial_running:
+                # Let exactly one request probe the database
+                self._trial_running = True
+                return
+            raise CircuitOpenError(self.name, max(1, int(remaining)))
+
+    def is_open(self):
+        """True while calls would be rejected without trying"""
+        with self._lock:
+            if self.state == 'closed':
+                return False
+            if self.state == 'open':
+                return time.monotonic() < self._opened_at + self.cooldown_seconds
+            return self._trial_running
+
+    def release_trial(self):
+        """Free the half-open slot after a call that tells nothing about health"""
+        with self._lock:
+            self._trial_running = False
+
+    def record(self, duration, failed):
+        failed = failed or duration > self.slow_call_seconds
+        now = time.monotonic()
+        with self._lock:
+            if self.state == 'half_open':
+                self._trial_running = False
+                if failed:
+                    self._open(now)
+                else:
+                    self.state = 'closed'
+                    self._failures.clear()
+                return
+            if not failed:
+                return
+            self._failures.append(now)
+            while self._failures and now - self._failures[0] > self.window_seconds:
+                self._failures.popleft()
+            if len(self._failures) >= self.failure_threshold:
+                self._open(now)
+
+    def _open(self, now):
+        if self.state != 'open':
+            print(f"⚠ Circuit {self.name} opened")
+        self.state = 'open'
+        self._opened_at = now
+        self._failures.clear()
+
+
+class GuardedQuery:
+    """Wraps a postgrest request builder so execute() goes through a breaker"""
+
+    def __init__(self, client, table, query, operation=None):
+        self._client = client
+        self._table = table
+        self._query = query
+        self._operation = operation
+
+    def __getattr__(self, name):
+        attr = getattr(self._query, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if hasattr(result, 'execute'):
+                operation = self._operation or (name if name in WRITE_OPERATIONS + ('select',) else None)
+                return GuardedQuery(self._client, self._table, result, operation)
+            return result
+        return call
+
+    def execute(self):
+        return self._client.run(self._table, self._operation or 'select', self._query)
+
+
+class GuardedClient:
+    """Supabase client facade with per-table circuit breakers"""
+
+    def __init__(self, client, name, **breaker_options):
+        self.client = client
+        self.name = name
+        self.breaker_options = breaker_options
+        # Optional callback(table, operation, started, duration, failed), e.g. for profiling
+        self.observer = None
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def table(self, table):
+        return GuardedQuery(self, table, self.client.table(table))
+
+    def rpc(self, fn, params=None):
+        return GuardedQuery(self, f"rpc:{fn}", self.client.rpc(fn, params or {}), 'rpc')
+
+    def is_open(self, table):
+        with self._lock:
+            breaker = self._breakers.get(table)
+        return breaker is not None and breaker.is_open()
+
+    def breaker(self, table):
+        with self._lock:
+            breaker = self._breakers.get(table)
+            if breaker is None:
+                breaker = self._breakers[table] = CircuitBreaker(f"{self.name}:{table}", **self.breaker_options)
+            return breaker
+
+    def run(self, table, operation, query):
+        breaker = self.breaker(table)
+        breaker.before_call()
+        started = time.perf_counter()
+        error = None
+        try:
+            return query.execute()
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            try:
+                server_failure = error is not None and is_server_failure(error)
+            except Exception:
+                # Never let classification skip record()/release_trial()
+                server_failure = True
+            if error is None or server_failure:
+                breaker.record(duration, failed=error is not None)
+            else:
+                # Bad input (4xx): the database answered, so it neither trips
+                # the breaker nor counts as a healthy trial
+                breaker.release_trial()
+            if self.observer:
+                try:
+                    self.observer(table, operation, started, duration, error is not None)
+                except Exception as e:
+                    print(f"Database call observer failed: {e}")
+
+
+class StaleCache:
+    """Bounded LRU of last-known-good read responses"""
+
+    def __init__(self, max_entries=2000, max_age_seconds=3600):
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        """(value, age_seconds) or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        age = time.time() - entry[0]
+        if age > self.max_age_seconds:
+            return None
+        return entry[1], age
@@ -0,0 +1,110 @@
+"""
+Read-replica routing for Bolt Nexus.
+
+Writes always go to the primary. Read endpoints go to a replica, unless the
+caller wrote something the replica has not replayed yet. After a write the
+backend records the primary's WAL position (LSN) for the affected user or
+technician and returns it to the client as a token; a later read carrying
+that token (or served by the same worker) only uses a replica whose replay
+position has reached it. Replicas with an open circuit breaker for the tables
+being read are skipped; the primary is the fallback.
+"""
+
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+# Used when the write LSN could not be read: force primary reads for a while
+UNKNOWN_LSN = float('inf')
+UNKNOWN_LSN_TTL = 30
+
+
+def parse_lsn(value):
+    """'16/B374D848' -> int, None if missing or malformed"""
+    try:
+        high, low = value.split('/')
+        return (int(high, 16) << 32) + int(low, 16)
+    except (AttributeError, ValueError):
+        return None
+
+
+class ReplicaRouter:
+    """Pick the primary or a replica client for each read"""
+
+    def __init__(self, primary, replicas, lag_check_interval=0.5, remember=10000):
+        self.primary = primary
+        self.replicas = replicas
+        self.lag_check_interval = lag_check_interval
+        self.remember = remember
+        self._round_robin = itertools.cycle(range(len(replicas))) if replicas else None
+        self._replayed = {}  # replica index -> (checked_at, replay LSN)
+        self._last_writes = OrderedDict()  # key -> (LSN, noted_at)
+        self._lock = threading.Lock()
+
+    def note_write(self, keys):
+        """Record a write for each key; returns the token for the client"""
+        if not self.replicas:
+            return None
+        try:
+            lsn = parse_lsn(self.primary.rpc('wal_write_lsn', {}).execute().data)
+        except Exception as e:
+            print(f"Could not read write LSN: {e}")
+            lsn = None
+
+        noted_at = time.monotonic()
+        with self._lock:
+            for key in keys:
+                self._last_writes[key] = (lsn if lsn is not None else UNKNOWN_LSN, noted_at)
+                self._last_writes.move_to_end(key)
+            while len(self._last_writes) > self.remember:
+                self._last_writes.popitem(last=False)
+        return f"{lsn >> 32:X}/{lsn & 0xFFFFFFFF:X}" if lsn is not None else None
+
+    def reader(self, key, token=None, tables=()):
+        """Client to serve a read for key; token is the client's last write LSN
+
+        Replicas whose circuit is open for any of tables are skipped.
+        """
+        if not self.replicas:
+            return self.primary
+
+        required = self._required_lsn(key, parse_lsn(token))
+        with self._lock:
+            start = next(self._round_robin)
+        for offset in range(len(self.replicas)):
+            index = (start + offset) % len(self.replicas)
+            replica = self.replicas[index]
+            if any(replica.is_open(table) for table in tables):
+                continue
+            if required is None:
+                return replica
+            replayed = self._replay_lsn(index)
+            if replayed is not None and replayed >= required:
+                return replica
+        return self.primary
+
+    def _required_lsn(self, key, token_lsn):
+        with self._lock:
+            entry = self._last_writes.get(key)
+        local = None
+        if entry:
+            lsn, noted_at = entry
+            if lsn != UNKNOWN_LSN or time.monotonic() - noted_at < UNKNOWN_LSN_TTL:
+                local = lsn
+        candidates = [lsn for lsn in (local, token_lsn) if lsn is not None]
+        return max(candidates) if candidates else None
+
+    def _replay_lsn(self, index):
+        """Replica replay position, cached for lag_check_interval seconds"""
+        now = time.monotonic()
+        cached = self._replayed.get(index)
+        if cached and now - cached[0] < self.lag_check_interval:
+            return cached[1]
+        try:
+            lsn = parse_lsn(self.replicas[index].rpc('wal_replay_lsn', {}).execute().data)
+        except Exception as e:
+            print(f"Could not read replay LSN from replica {index}: {e}")
+            lsn = None
+        self._replayed[index] = (now, lsn)
+        return lsn
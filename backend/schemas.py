@@ -0,0 +1,117 @@
+"""
+Request schemas for the Bolt Nexus API.
+
+Each POST body is decoded and validated by msgspec in a single pass, before
+any database call. Decoding is lax (strict=False) so form values sent as
+strings, e.g. "8" for usage_hours_per_day, are coerced to the declared type.
+Optional text fields left empty in the forms ('') are stored as None.
+"""
+
+from datetime import datetime
+from typing import Annotated, Literal, Optional
+
+import msgspec
+from msgspec import Meta, Struct
+
+ApplianceType = Literal['AC', 'Fridge', 'Washing Machine']
+ServiceType = Literal['one_time', 'amc']
+
+Text = Annotated[str, Meta(min_length=1, max_length=200)]
+# For optional fields: '' is accepted here and turned into None by blank_to_none
+OptionalText = Annotated[str, Meta(max_length=200)]
+Email = Annotated[str, Meta(pattern=r'^[^@\s]+@[^@\s]+\.[^@\s]+$', max_length=254)]
+Phone = Annotated[str, Meta(pattern=r'^\+?[0-9 ()-]{7,20}$')]
+Id = Annotated[int, Meta(gt=0)]
+Hours = Annotated[float, Meta(ge=0, le=24)]
+Months = Annotated[int, Meta(ge=0, le=600)]
+Amount = Annotated[float, Meta(ge=0)]
+Year = Annotated[int, Meta(ge=1950, le=2100)]
+# A date, or a date and time as sent by <input type="datetime-local">
+DateString = Annotated[str, Meta(
+    pattern=r'^\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?)?$'
+)]
+
+
+def blank_to_none(obj, fields):
+    for field in fields:
+        value = getattr(obj, field)
+        if value is not None and not value.strip():
+            setattr(obj, field, None)
+
+
+class RegisterRequest(Struct):
+    name: Text
+    phone: Phone
+    email: Email
+    appliance_type: ApplianceType
+    city: Optional[OptionalText] = None
+    brand_model: Optional[OptionalText] = None
+    appliance_age_years: Annotated[int, Meta(ge=0, le=50)] = 2
+    usage_hours_per_day: Optional[Hours] = None
+    months_since_service: Optional[Months] = None
+    current_bill: Amount = 3000
+    maintenance_probability: Annotated[float, Meta(ge=0, le=100)] = 0
+    estimated_savings: Amount = 0
+
+    def __post_init__(self):
+        blank_to_none(self, ('city', 'brand_model'))
+
+
+class DiagnosticRequest(Struct):
+    name: Text
+    phone: Phone
+    email: Email
+    appliance_type: ApplianceType
+    city: Optional[OptionalText] = None
+    brand_model: Optional[OptionalText] = None
+    year_of_purchase: Optional[Year] = None
+    usage_hours_per_day: Optional[Hours] = None
+    months_since_service: Optional[Months] = None
+
+    def __post_init__(self):
+        blank_to_none(self, ('city', 'brand_model'))
+
+
+class BookingRequest(Struct):
+    user_id: Id
+    appliance_id: Id
+    service_type: ServiceType
+    scheduled_date: Optional[DateString] = None
+
+    def __post_init__(self):
+        if self.scheduled_date:
+            # The pattern checks the shape; this rejects e.g. 2026-02-30
+            # (msgspec reports the ValueError as a ValidationError)
+            datetime.fromisoformat(self.scheduled_date.replace('Z', '+00:00'))
+
+
+class CreateOrderRequest(Struct):
+    booking_id: Id
+    amount: Annotated[float, Meta(gt=0)]
+    user_id: Optional[Id] = None
+
+
+class VerifyPaymentRequest(Struct):
+    razorpay_order_id: Text
+    razorpay_payment_id: Text
+    razorpay_signature: Annotated[str, Meta(pattern=r'^[0-9a-f]{64}$')]
+
+
+class CompleteJobRequest(Struct):
+    technician_id: Optional[Id] = None
+    notes: Optional[Annotated[str, Meta(max_length=5000)]] = None
+    parts_replaced: Optional[Annotated[str, Meta(max_length=1000)]] = None
+    verified_savings: Optional[Amount] = None
+
+
+# Decoders are built once; decoding with a prebuilt decoder avoids
+# re-inspecting the type on every request
+_decoders = {}
+
+
+def decode(schema, body):
+    """Decode and validate a JSON body; raises msgspec.DecodeError/ValidationError"""
+    decoder = _decoders.get(schema)
+    if decoder is None:
+        decoder = _decoders[schema] = msgspec.json.Decoder(schema, strict=False)
+    return decoder.decode(body)
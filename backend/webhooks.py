@@ -0,0 +1,224 @@
+"""
+Razorpay webhook handling for Bolt Nexus.
+
+The webhook endpoint verifies the signature, stores the raw event as
+pending (one insert) and acknowledges Razorpay; nothing is acknowledged
+before it is stored. A background thread in each worker drains an in-memory
+queue and applies payment/booking/appliance changes in batches through a
+single database call. Events left pending by a worker that died are picked
+up again from the table, and events that keep failing are dead-lettered.
+"""
+
+import atexit
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict, deque
+
+from resilience import CircuitOpenError, is_server_failure
+
+# Razorpay event -> payments.status
+PAYMENT_EVENT_STATUS = {
+    'payment.captured': 'success',
+    'order.paid': 'success',
+    'payment.failed': 'failed'
+}
+
+
+def sign(message, secret):
+    """Hex HMAC-SHA256 as Razorpay computes it"""
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def verify_signature(message, signature, secret):
+    """Constant-time comparison of a Razorpay signature"""
+    if not signature or not secret:
+        return False
+    return hmac.compare_digest(sign(message, secret), signature)
+
+
+def parse_payment_event(payload, event_id=None):
+    """Reduce a Razorpay webhook payload to the fields we apply, or None"""
+    event_type = payload.get('event')
+    status = PAYMENT_EVENT_STATUS.get(event_type)
+    if status is None:
+        return None
+
+    payment = ((payload.get('payload') or {}).get('payment') or {}).get('entity') or {}
+    order = ((payload.get('payload') or {}).get('order') or {}).get('entity') or {}
+    order_id = payment.get('order_id') or order.get('id')
+    if not order_id:
+        return None
+
+    return {
+        'event_id': event_id or f"{event_type}:{payment.get('id') or order_id}",
+        'event_type': event_type,
+        'order_id': order_id,
+        'payment_id': payment.get('id'),
+        'method': payment.get('method'),
+        'status': status
+    }
+
+
+class WebhookQueue:
+    """Deduplicating in-memory queue applied in batches by a worker thread
+
+    load_pending() returns stored events that still need applying (checked
+    every recover_interval seconds while idle); dead_letter(events, error)
+    is called for events that failed max_attempts times. Timeouts, server
+    errors and open circuits are retried without counting as attempts.
+    """
+
+    def __init__(self, apply_batch, batch_size=100, flush_interval=0.2,
+                 max_pending=10000, remember=50000, max_retry_delay=30,
+                 max_attempts=8, dead_letter=None, load_pending=None, recover_interval=60):
+        self.apply_batch = apply_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.remember = remember
+        self.max_retry_delay = max_retry_delay
+        self.max_attempts = max_attempts
+        self.dead_letter = dead_letter
+        self.load_pending = load_pending
+        self.recover_interval = recover_interval
+        self._pending = deque()
+        self._seen = OrderedDict()
+        self._attempts = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._in_flight = 0
+        atexit.register(self.drain)
+
+    def enqueue(self, event):
+        """Returns 'queued', 'duplicate' or 'full'"""
+        with self._condition:
+            event_id = event['event_id']
+            if event_id in self._seen:
+                self._seen.move_to_end(event_id)
+                return 'duplicate'
+            if len(self._pending) >= self.max_pending:
+                return 'full'
+
+            self._seen[event_id] = True
+            if len(self._seen) > self.remember:
+                self._seen.popitem(last=False)
+            self._pending.append(event)
+            self._ensure_thread()
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify()
+            return 'queued'
+
+    def pending(self):
+        """Events not yet applied, including the batch being written"""
+        with self._condition:
+            return len(self._pending) + self._in_flight
+
+    def drain(self, timeout=10):
+        """Flush what is queued (called on worker shutdown)"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        while self.pending() and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def start(self):
+        """Start the worker thread now (it otherwise starts on first enqueue)"""
+        with self._condition:
+            self._ensure_thread()
+
+    def _ensure_thread(self):
+        # Started lazily so each gunicorn worker gets its own thread after fork
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _next_batch(self):
+        with self._condition:
+            # Wait a little so bursts are applied together
+            self._condition.wait_for(
+                lambda: len(self._pending) >= self.batch_size or self._stopping,
+                self.flush_interval
+            )
+            count = min(len(self._pending), self.batch_size)
+            if count and self._attempts.get(self._pending[0]['event_id'], 0) >= 2:
+                # A batch that failed twice is retried one event at a time,
+                # so a single bad event cannot hold back the others
+                count = 1
+            self._in_flight = count
+            return [self._pending.popleft() for _ in range(count)]
+
+    def _recover(self):
+        """Queue stored events that no worker has applied yet"""
+        try:
+            events = self.load_pending()
+        except Exception as e:
+            print(f"Failed to load pending webhook events: {e}")
+            return
+        for event in events:
+            if self.enqueue(event) == 'full':
+                break
+
+    def _give_up(self, batch, error):
+        """Drop events that used up their attempts and hand them to dead_letter"""
+        dead, retry = [], []
+        with self._condition:
+            for event in batch:
+                attempts = self._attempts.get(event['event_id'], 0) + 1
+                if attempts >= self.max_attempts:
+                    self._attempts.pop(event['event_id'], None)
+                    # Forget it so recovery can pick it up if dead-lettering fails
+                    self._seen.pop(event['event_id'], None)
+                    dead.append(event)
+                else:
+                    self._attempts[event['event_id']] = attempts
+                    retry.append(event)
+        if dead:
+            print(f"Dead-lettering {len(dead)} webhook events after {self.max_attempts} attempts: {error}")
+            if self.dead_letter:
+                try:
+                    self.dead_letter(dead, error)
+                except Exception as e:
+                    print(f"Failed to dead-letter webhook events: {e}")
+        return retry
+
+    def _run(self):
+        retry_delay = 0.5
+        next_recovery = time.monotonic()
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                if self._stopping:
+                    return
+                if self.load_pending and time.monotonic() >= next_recovery:
+                    next_recovery = time.monotonic() + self.recover_interval
+                    self._recover()
+                continue
+            try:
+                self.apply_batch(batch)
+                with self._condition:
+                    self._in_flight = 0
+                    for event in batch:
+                        self._attempts.pop(event['event_id'], None)
+                retry_delay = 0.5
+            except Exception as e:
+                # Put the batch back in order and back off; the database call
+                # marks each stored event applied, so a retried event is applied once
+                print(f"Failed to apply {len(batch)} webhook events: {e}")
+                if isinstance(e, CircuitOpenError) or is_server_failure(e):
+                    # Database trouble says nothing about the events: back off
+                    # without counting it towards max_attempts
+                    retry = batch
+                else:
+                    retry = self._give_up(batch, e)
+                with self._condition:
+                    self._pending.extendleft(reversed(retry))
+                    self._in_flight = 0
+                    if self._stopping:
+                        return
+                if retry:
+                    time.sleep(retry_delay)
+                    retry_delay = min(retry_delay * 2, self.max_retry_delay)
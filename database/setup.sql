@@ -2,6 +2,12 @@
 -- Run this in your Supabase SQL Editor
 
 -- Drop existing tables if they exist (for fresh start)
+DROP TABLE IF EXISTS booking_tombstones CASCADE;
+DROP TABLE IF EXISTS payment_webhook_events CASCADE;
+DROP TABLE IF EXISTS analytics_daily_bookings CASCADE;
+DROP TABLE IF EXISTS analytics_daily_funnel CASCADE;
+DROP TABLE IF EXISTS analytics_daily_revenue CASCADE;
+DROP TABLE IF EXISTS analytics_refresh_state CASCADE;
 DROP TABLE IF EXISTS service_notes CASCADE;
 DROP TABLE IF EXISTS payments CASCADE;
 DROP TABLE IF EXISTS bookings CASCADE;
@@ -40,16 +46,19 @@ CREATE TABLE appliances (
 );
 
 -- Diagnostics table (stores diagnostic reports)
+-- Partitioned by month on created_at, like payments and service_notes
 CREATE TABLE diagnostics (
-  id BIGSERIAL PRIMARY KEY,
+  id BIGSERIAL,
   user_id BIGINT REFERENCES users(id) ON DELETE CASCADE,
   appliance_id BIGINT REFERENCES appliances(id) ON DELETE CASCADE,
   health_score INTEGER,
   energy_loss_per_month DECIMAL(10,2),
   estimated_savings DECIMAL(10,2),
   recommendations TEXT,
-  created_at TIMESTAMPTZ DEFAULT NOW()
-);
+  input_fingerprint TEXT, -- sha256 of the submitted form, for dedup of resubmissions
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
 
 -- Technicians table
 CREATE TABLE technicians (
@@ -79,9 +88,9 @@ CREATE TABLE bookings (
   updated_at TIMESTAMPTZ DEFAULT NOW()
 );
 
--- Payments table
+-- Payments table (partitioned by month on created_at)
 CREATE TABLE payments (
-  id BIGSERIAL PRIMARY KEY,
+  id BIGSERIAL,
   booking_id BIGINT REFERENCES bookings(id) ON DELETE CASCADE,
   user_id BIGINT REFERENCES users(id) ON DELETE CASCADE,
   razorpay_order_id TEXT,
@@ -91,13 +100,14 @@ CREATE TABLE payments (
   currency TEXT DEFAULT 'INR',
   status TEXT DEFAULT 'pending', -- 'pending', 'success', 'failed'
   payment_method TEXT,
-  created_at TIMESTAMPTZ DEFAULT NOW(),
-  updated_at TIMESTAMPTZ DEFAULT NOW()
-);
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  updated_at TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
 
--- Service notes table
+-- Service notes table (partitioned by month on created_at)
 CREATE TABLE service_notes (
-  id BIGSERIAL PRIMARY KEY,
+  id BIGSERIAL,
   booking_id BIGINT REFERENCES bookings(id) ON DELETE CASCADE,
   technician_id BIGINT REFERENCES technicians(id),
   notes TEXT,
@@ -105,7 +115,90 @@ CREATE TABLE service_notes (
   after_images TEXT[], -- Array of image URLs
   parts_replaced TEXT,
   verified_savings DECIMAL(10,2),
-  created_at TIMESTAMPTZ DEFAULT NOW()
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- ============================================================
+-- Monthly partitions for diagnostics, payments and service_notes
+-- Partitions are named <table>_YYYY_MM and cover calendar months in UTC.
+-- Old months are exported and dropped by backend/archive_partitions.py.
+-- ============================================================
+
+-- Rows for a month that has no partition yet land here instead of failing
+CREATE TABLE diagnostics_default PARTITION OF diagnostics DEFAULT;
+CREATE TABLE payments_default PARTITION OF payments DEFAULT;
+CREATE TABLE service_notes_default PARTITION OF service_notes DEFAULT;
+
+-- Create the partitions for the next few months of one table (idempotent).
+-- Rows that already landed in the default partition are moved across.
+CREATE OR REPLACE FUNCTION create_monthly_partitions(parent TEXT, months_ahead INTEGER DEFAULT 3, months_back INTEGER DEFAULT 0)
+RETURNS INTEGER AS $$
+DECLARE
+  month_start TIMESTAMPTZ;
+  month_end TIMESTAMPTZ;
+  partition_name TEXT;
+  created INTEGER := 0;
+BEGIN
+  IF parent NOT IN ('diagnostics', 'payments', 'service_notes') THEN
+    RAISE EXCEPTION 'Not a monthly partitioned table: %', parent;
+  END IF;
+  months_ahead := LEAST(GREATEST(months_ahead, 0), 12);
+  months_back := LEAST(GREATEST(months_back, 0), 24);
+
+  FOR i IN -months_back..months_ahead LOOP
+    month_start := date_trunc('month', NOW() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' + make_interval(months => i);
+    month_end := month_start + INTERVAL '1 month';
+    partition_name := format('%s_%s', parent, to_char(month_start AT TIME ZONE 'UTC', 'YYYY_MM'));
+
+    CONTINUE WHEN to_regclass(partition_name) IS NOT NULL;
+
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS)', partition_name, parent);
+    EXECUTE format(
+      'WITH moved AS (DELETE FROM %I WHERE created_at >= %L AND created_at < %L RETURNING *) INSERT INTO %I SELECT * FROM moved',
+      parent || '_default', month_start, month_end, partition_name
+    );
+    EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+      parent, partition_name, month_start, month_end);
+    -- Reads go through the parent; keep the partition itself closed to the API
+    EXECUTE format('ALTER TABLE %I ENABLE ROW LEVEL SECURITY', partition_name);
+    created := created + 1;
+  END LOOP;
+  RETURN created;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+CREATE OR REPLACE FUNCTION ensure_monthly_partitions(months_ahead INTEGER DEFAULT 3)
+RETURNS INTEGER AS $$
+  SELECT create_monthly_partitions('diagnostics', months_ahead)
+       + create_monthly_partitions('payments', months_ahead)
+       + create_monthly_partitions('service_notes', months_ahead);
+$$ LANGUAGE sql SECURITY DEFINER SET search_path = public;
+
+-- These run DDL as the owner: keep them away from the anon/authenticated API
+-- keys (the backend calls ensure_monthly_partitions with the service key)
+REVOKE EXECUTE ON FUNCTION create_monthly_partitions(TEXT, INTEGER, INTEGER) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION ensure_monthly_partitions(INTEGER) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION ensure_monthly_partitions(INTEGER) TO service_role;
+
+SELECT ensure_monthly_partitions();
+
+-- The backend also calls ensure_monthly_partitions() on startup. With pg_cron
+-- enabled, keep partitions created ahead even when nothing restarts:
+-- SELECT cron.schedule('ensure-partitions', '0 3 * * *', 'SELECT ensure_monthly_partitions()');
+
+-- Razorpay webhook events, stored before they are acknowledged. The primary
+-- key dedupes Razorpay retries; workers apply pending events and mark them
+-- applied, or dead after repeated failures (set back to pending to retry).
+CREATE TABLE payment_webhook_events (
+  event_id TEXT PRIMARY KEY,
+  event_type TEXT NOT NULL,
+  razorpay_order_id TEXT,
+  event JSONB NOT NULL,
+  state TEXT NOT NULL DEFAULT 'pending' CHECK (state IN ('pending', 'applied', 'dead')),
+  last_error TEXT,
+  received_at TIMESTAMPTZ DEFAULT NOW(),
+  processed_at TIMESTAMPTZ
 );
 
 -- Enable Row Level Security
@@ -116,6 +209,11 @@ ALTER TABLE technicians ENABLE ROW LEVEL SECURITY;
 ALTER TABLE bookings ENABLE ROW LEVEL SECURITY;
 ALTER TABLE payments ENABLE ROW LEVEL SECURITY;
 ALTER TABLE service_notes ENABLE ROW LEVEL SECURITY;
+-- Like the monthly partitions, default partitions are only read through the parent
+ALTER TABLE diagnostics_default ENABLE ROW LEVEL SECURITY;
+ALTER TABLE payments_default ENABLE ROW LEVEL SECURITY;
+ALTER TABLE service_notes_default ENABLE ROW LEVEL SECURITY;
+ALTER TABLE payment_webhook_events ENABLE ROW LEVEL SECURITY;
 
 -- Create policies (allow all for MVP - add proper auth later)
 CREATE POLICY "Allow all on users" ON users FOR ALL USING (true) WITH CHECK (true);
@@ -125,17 +223,421 @@ CREATE POLICY "Allow all on technicians" ON technicians FOR ALL USING (true) WIT
 CREATE POLICY "Allow all on bookings" ON bookings FOR ALL USING (true) WITH CHECK (true);
 CREATE POLICY "Allow all on payments" ON payments FOR ALL USING (true) WITH CHECK (true);
 CREATE POLICY "Allow all on service_notes" ON service_notes FOR ALL USING (true) WITH CHECK (true);
+-- No policy on payment_webhook_events: a pending row gets applied as a paid
+-- payment, so only the backend's service key (which bypasses RLS) may touch it
+REVOKE ALL ON payment_webhook_events FROM anon, authenticated;
 
 -- Create indexes for performance
 CREATE INDEX idx_appliances_user_id ON appliances(user_id);
 CREATE INDEX idx_diagnostics_user_id ON diagnostics(user_id);
 CREATE INDEX idx_diagnostics_appliance_id ON diagnostics(appliance_id);
+CREATE INDEX idx_diagnostics_fingerprint ON diagnostics(input_fingerprint, created_at DESC);
+CREATE INDEX idx_payment_webhook_events_pending ON payment_webhook_events(received_at) WHERE state = 'pending';
 CREATE INDEX idx_bookings_user_id ON bookings(user_id);
 CREATE INDEX idx_bookings_technician_id ON bookings(technician_id);
 CREATE INDEX idx_bookings_status ON bookings(status);
 CREATE INDEX idx_payments_booking_id ON payments(booking_id);
+CREATE INDEX idx_payments_razorpay_order_id ON payments(razorpay_order_id);
 CREATE INDEX idx_service_notes_booking_id ON service_notes(booking_id);
 
+-- Indexes used by the incremental analytics refresh
+CREATE INDEX idx_payments_updated_at ON payments(updated_at);
+CREATE INDEX idx_bookings_updated_at ON bookings(updated_at);
+CREATE INDEX idx_diagnostics_created_at ON diagnostics(created_at);
+CREATE INDEX idx_payments_created_at ON payments(created_at);
+CREATE INDEX idx_bookings_created_at ON bookings(created_at);
+
+-- ============================================================
+-- Technician app delta sync
+-- Clients ask for bookings changed since a (updated_at, id) cursor.
+-- Bookings that leave a technician (deleted or reassigned) leave a
+-- tombstone so the app can drop them.
+-- ============================================================
+
+CREATE TABLE booking_tombstones (
+  id BIGSERIAL PRIMARY KEY,
+  booking_id BIGINT NOT NULL,
+  technician_id BIGINT NOT NULL,
+  removed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX idx_booking_tombstones_technician ON booking_tombstones(technician_id, removed_at);
+CREATE INDEX idx_bookings_technician_updated_at ON bookings(technician_id, updated_at, id);
+
+ALTER TABLE booking_tombstones ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Allow all on booking_tombstones" ON booking_tombstones FOR ALL USING (true) WITH CHECK (true);
+
+-- Every booking change bumps updated_at, whatever code path made it
+CREATE OR REPLACE FUNCTION set_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN
+  NEW.updated_at := NOW();
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER bookings_set_updated_at
+  BEFORE UPDATE ON bookings
+  FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+CREATE OR REPLACE FUNCTION record_booking_tombstone()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF OLD.technician_id IS NOT NULL
+     AND (TG_OP = 'DELETE' OR OLD.technician_id IS DISTINCT FROM NEW.technician_id) THEN
+    INSERT INTO booking_tombstones (booking_id, technician_id) VALUES (OLD.id, OLD.technician_id);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER bookings_record_tombstone
+  AFTER DELETE OR UPDATE OF technician_id ON bookings
+  FOR EACH ROW EXECUTE FUNCTION record_booking_tombstone();
+
+-- One page of changes after the cursor, shaped like GET /api/technician/<id>/jobs
+CREATE OR REPLACE FUNCTION technician_job_changes(
+  tech_id BIGINT,
+  since_at TIMESTAMPTZ DEFAULT '-infinity',
+  since_id BIGINT DEFAULT 0,
+  max_rows INTEGER DEFAULT 200
+)
+RETURNS JSONB AS $$
+  WITH changed AS (
+    SELECT b.*
+      FROM bookings b
+     WHERE b.technician_id = tech_id
+       AND (b.updated_at, b.id) > (since_at, since_id)
+     ORDER BY b.updated_at, b.id
+     LIMIT max_rows
+  )
+  SELECT jsonb_build_object(
+    'changes', COALESCE(jsonb_agg(
+      to_jsonb(c) || jsonb_build_object(
+        'users', (SELECT jsonb_build_object('name', u.name, 'phone', u.phone, 'email', u.email, 'city', u.city)
+                    FROM users u WHERE u.id = c.user_id),
+        'appliances', (SELECT jsonb_build_object('appliance_type', a.appliance_type, 'brand_model', a.brand_model)
+                         FROM appliances a WHERE a.id = c.appliance_id)
+      ) ORDER BY c.updated_at, c.id
+    ) FILTER (WHERE c.id IS NOT NULL), '[]'::JSONB),
+    -- Skip tombstones for bookings that have since come back to this technician
+    'removed', (
+      SELECT COALESCE(jsonb_agg(DISTINCT t.booking_id), '[]'::JSONB)
+        FROM booking_tombstones t
+       WHERE t.technician_id = tech_id
+         AND t.removed_at >= since_at
+         AND NOT EXISTS (SELECT 1 FROM bookings b WHERE b.id = t.booking_id AND b.technician_id = tech_id)
+    ),
+    'server_time', NOW()
+  )
+  FROM (SELECT 1) one
+  LEFT JOIN changed c ON TRUE;
+$$ LANGUAGE sql STABLE;
+
+-- Tokens older than the tombstone retention must do a full resync
+CREATE OR REPLACE FUNCTION purge_booking_tombstones(keep_days INTEGER DEFAULT 30)
+RETURNS INTEGER AS $$
+  WITH purged AS (
+    DELETE FROM booking_tombstones WHERE removed_at < NOW() - make_interval(days => keep_days) RETURNING 1
+  )
+  SELECT COUNT(*)::INTEGER FROM purged;
+$$ LANGUAGE sql;
+
+-- With pg_cron: SELECT cron.schedule('purge-tombstones', '30 3 * * *', 'SELECT purge_booking_tombstones()');
+
+-- ============================================================
+-- Read replicas
+-- The backend asks the primary for its WAL position after writes and
+-- replicas for their replay position, to keep read-your-writes.
+-- ============================================================
+
+-- Both run as the caller (the anon key): the WAL functions they wrap are
+-- executable by PUBLIC, so they need no owner privileges
+CREATE OR REPLACE FUNCTION wal_write_lsn()
+RETURNS TEXT AS $$
+  SELECT pg_current_wal_lsn()::TEXT;
+$$ LANGUAGE sql;
+
+-- On a primary (e.g. a local stand-in without replication) there is nothing
+-- to replay, so report the current position instead
+CREATE OR REPLACE FUNCTION wal_replay_lsn()
+RETURNS TEXT AS $$
+  SELECT COALESCE(pg_last_wal_replay_lsn(), pg_current_wal_lsn())::TEXT;
+$$ LANGUAGE sql;
+
+-- ============================================================
+-- Razorpay webhooks
+-- The backend queues verified webhook events and applies them in batches
+-- with one call to this function (one transaction per batch).
+-- ============================================================
+
+CREATE OR REPLACE FUNCTION apply_payment_events(events JSONB)
+RETURNS TABLE (
+  id BIGINT,
+  user_id BIGINT,
+  technician_id BIGINT,
+  appliance_id BIGINT,
+  appliance_type TEXT,
+  service_type TEXT,
+  scheduled_date TIMESTAMPTZ,
+  status TEXT,
+  payment_status TEXT,
+  updated_at TIMESTAMPTZ
+) AS $$
+  WITH incoming AS (
+    SELECT *
+      FROM jsonb_to_recordset(events)
+        AS e(event_id TEXT, event_type TEXT, order_id TEXT, payment_id TEXT, method TEXT, status TEXT)
+  ),
+  -- Skip events applied by an earlier batch (retries, other workers' recovery)
+  fresh AS (
+    UPDATE payment_webhook_events w
+       SET state = 'applied',
+           processed_at = NOW()
+      FROM incoming i
+     WHERE w.event_id = i.event_id
+       AND w.state = 'pending'
+    RETURNING w.event_id
+  ),
+  -- One outcome per order; a capture wins over a failed attempt in the same batch
+  latest AS (
+    SELECT DISTINCT ON (i.order_id) i.*
+      FROM incoming i
+      JOIN fresh f ON f.event_id = i.event_id
+     ORDER BY i.order_id, (i.status = 'success') DESC
+  ),
+  paid AS (
+    UPDATE payments p
+       SET razorpay_payment_id = COALESCE(l.payment_id, p.razorpay_payment_id),
+           payment_method = COALESCE(l.method, p.payment_method),
+           status = l.status,
+           updated_at = NOW()
+      FROM latest l
+     WHERE p.razorpay_order_id = l.order_id
+       AND p.created_at >= NOW() - INTERVAL '30 days' -- recent partitions only
+       AND p.status <> 'success'
+    RETURNING p.booking_id, p.status
+  ),
+  booked AS (
+    UPDATE bookings b
+       SET payment_status = CASE WHEN paid.status = 'success' THEN 'paid' ELSE 'failed' END,
+           status = CASE WHEN paid.status = 'success' AND b.status = 'pending' THEN 'confirmed' ELSE b.status END,
+           updated_at = NOW()
+      FROM paid
+     WHERE b.id = paid.booking_id
+       AND b.payment_status <> 'paid'
+    RETURNING b.*
+  ),
+  scheduled AS (
+    UPDATE appliances a
+       SET status = 'service_scheduled',
+           updated_at = NOW()
+      FROM booked
+     WHERE a.id = booked.appliance_id
+       AND booked.payment_status = 'paid'
+    RETURNING a.id
+  )
+  SELECT booked.id, booked.user_id, booked.technician_id, booked.appliance_id,
+         booked.appliance_type, booked.service_type, booked.scheduled_date,
+         booked.status, booked.payment_status, booked.updated_at
+    FROM booked;
+$$ LANGUAGE sql;
+
+-- Marks payments paid without a signature check of its own: backend only
+REVOKE EXECUTE ON FUNCTION apply_payment_events(JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION apply_payment_events(JSONB) TO service_role;
+
+-- ============================================================
+-- Analytics rollups (daily, IST business days)
+-- Admin analytics endpoints read these instead of the raw tables.
+-- ============================================================
+
+-- Revenue per day (payments)
+CREATE TABLE analytics_daily_revenue (
+  day DATE PRIMARY KEY,
+  payments_created INTEGER NOT NULL DEFAULT 0,
+  payments_succeeded INTEGER NOT NULL DEFAULT 0,
+  payments_failed INTEGER NOT NULL DEFAULT 0,
+  revenue DECIMAL(12,2) NOT NULL DEFAULT 0
+);
+
+-- Diagnostic -> booking -> paid funnel per day
+CREATE TABLE analytics_daily_funnel (
+  day DATE PRIMARY KEY,
+  diagnostics INTEGER NOT NULL DEFAULT 0,
+  bookings INTEGER NOT NULL DEFAULT 0,
+  paid_bookings INTEGER NOT NULL DEFAULT 0
+);
+
+-- Bookings per day, city and technician
+CREATE TABLE analytics_daily_bookings (
+  day DATE NOT NULL,
+  city TEXT,
+  technician_id BIGINT,
+  bookings INTEGER NOT NULL DEFAULT 0,
+  paid_bookings INTEGER NOT NULL DEFAULT 0,
+  completed_bookings INTEGER NOT NULL DEFAULT 0,
+  booked_amount DECIMAL(12,2) NOT NULL DEFAULT 0
+);
+
+CREATE INDEX idx_analytics_daily_bookings_day ON analytics_daily_bookings(day);
+
+-- Single-row watermark for the incremental refresh
+CREATE TABLE analytics_refresh_state (
+  id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+  refreshed_at TIMESTAMPTZ,
+  refreshed_days INTEGER, -- days recomputed by the last run
+  archived_before DATE -- set by archive_partitions.py; older rollup days are frozen
+);
+
+INSERT INTO analytics_refresh_state (id) VALUES (1);
+
+-- Recompute only the days touched since the last refresh.
+-- A day is "dirty" if any payment/booking on it was inserted or updated, or a
+-- diagnostic was created, after the previous run. Only the dirty days are
+-- deleted and re-aggregated from the raw tables, in one transaction; a full
+-- refresh treats every day with raw data or rollups as dirty.
+DROP FUNCTION IF EXISTS refresh_analytics_rollups(BOOLEAN);
+CREATE FUNCTION refresh_analytics_rollups(full_refresh BOOLEAN DEFAULT FALSE)
+RETURNS INTEGER AS $$
+DECLARE
+  last_run TIMESTAMPTZ;
+  frozen_before DATE;
+  run_started TIMESTAMPTZ := NOW();
+  dirty_days DATE[];
+BEGIN
+  SELECT refreshed_at, archived_before INTO last_run, frozen_before
+    FROM analytics_refresh_state WHERE id = 1 FOR UPDATE;
+
+  IF full_refresh OR last_run IS NULL THEN
+    SELECT array_agg(day) INTO dirty_days FROM (
+      SELECT (created_at AT TIME ZONE 'Asia/Kolkata')::DATE AS day FROM payments
+      UNION SELECT (created_at AT TIME ZONE 'Asia/Kolkata')::DATE FROM bookings
+      UNION SELECT (created_at AT TIME ZONE 'Asia/Kolkata')::DATE FROM diagnostics
+      UNION SELECT day FROM analytics_daily_revenue
+      UNION SELECT day FROM analytics_daily_funnel
+      UNION SELECT day FROM analytics_daily_bookings
+    ) days
+    -- Raw rows for archived months are gone; keep their rollups as they are
+    WHERE frozen_before IS NULL OR day >= frozen_before;
+  ELSE
+    SELECT array_agg(day) INTO dirty_days FROM (
+      SELECT (created_at AT TIME ZONE 'Asia/Kolkata')::DATE AS day
+        FROM payments WHERE updated_at >= last_run
+      UNION
+      SELECT (created_at AT TIME ZONE 'Asia/Kolkata')::DATE
+        FROM bookings WHERE updated_at >= last_run
+      UNION
+      SELECT (created_at AT TIME ZONE 'Asia/Kolkata')::DATE
+        FROM diagnostics WHERE created_at >= last_run
+    ) days
+    WHERE frozen_before IS NULL OR day >= frozen_before;
+  END IF;
+
+  IF dirty_days IS NOT NULL THEN
+    DELETE FROM analytics_daily_revenue WHERE day = ANY(dirty_days);
+    DELETE FROM analytics_daily_funnel WHERE day = ANY(dirty_days);
+    DELETE FROM analytics_daily_bookings WHERE day = ANY(dirty_days);
+
+    -- Each dirty day is read back as its own created_at range (indexed)
+    INSERT INTO analytics_daily_revenue (day, payments_created, payments_succeeded, payments_failed, revenue)
+    SELECT r.day,
+           COUNT(*),
+           COUNT(*) FILTER (WHERE p.status = 'success'),
+           COUNT(*) FILTER (WHERE p.status = 'failed'),
+           COALESCE(SUM(p.amount) FILTER (WHERE p.status = 'success'), 0)
+      FROM unnest(dirty_days) AS r(day)
+      JOIN payments p ON p.created_at >= r.day::TIMESTAMP AT TIME ZONE 'Asia/Kolkata'
+                     AND p.created_at < (r.day + 1)::TIMESTAMP AT TIME ZONE 'Asia/Kolkata'
+     GROUP BY r.day;
+
+    INSERT INTO analytics_daily_funnel (day, diagnostics, bookings, paid_bookings)
+    SELECT day, SUM(diagnostics), SUM(bookings), SUM(paid_bookings)
+      FROM (
+        SELECT r.day, COUNT(*) AS diagnostics, 0 AS bookings, 0 AS paid_bookings
+          FROM unnest(dirty_days) AS r(day)
+          JOIN diagnostics d ON d.created_at >= r.day::TIMESTAMP AT TIME ZONE 'Asia/Kolkata'
+                            AND d.created_at < (r.day + 1)::TIMESTAMP AT TIME ZONE 'Asia/Kolkata'
+         GROUP BY r.day
+        UNION ALL
+        SELECT r.day, 0, COUNT(*), COUNT(*) FILTER (WHERE b.payment_status = 'paid')
+          FROM unnest(dirty_days) AS r(day)
+          JOIN bookings b ON b.created_at >= r.day::TIMESTAMP AT TIME ZONE 'Asia/Kolkata'
+                         AND b.created_at < (r.day + 1)::TIMESTAMP AT TIME ZONE 'Asia/Kolkata'
+         GROUP BY r.day
+      ) per_source
+     GROUP BY day;
+
+    INSERT INTO analytics_daily_bookings (day, city, technician_id, bookings, paid_bookings, completed_bookings, booked_amount)
+    SELECT r.day,
+           u.city,
+           b.technician_id,
+           COUNT(*),
+           COUNT(*) FILTER (WHERE b.payment_status = 'paid'),
+           COUNT(*) FILTER (WHERE b.status = 'completed'),
+           COALESCE(SUM(b.service_amount), 0)
+      FROM unnest(dirty_days) AS r(day)
+      JOIN bookings b ON b.created_at >= r.day::TIMESTAMP AT TIME ZONE 'Asia/Kolkata'
+                     AND b.created_at < (r.day + 1)::TIMESTAMP AT TIME ZONE 'Asia/Kolkata'
+      LEFT JOIN users u ON u.id = b.user_id
+     GROUP BY 1, 2, 3;
+  END IF;
+
+  -- Step the watermark back a little so rows committed by transactions that
+  -- were still in flight when this run started are picked up next time.
+  UPDATE analytics_refresh_state
+     SET refreshed_at = run_started - INTERVAL '5 minutes',
+         refreshed_days = COALESCE(cardinality(dirty_days), 0)
+   WHERE id = 1;
+
+  RETURN COALESCE(cardinality(dirty_days), 0);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Only the backend (service key) and pg_cron refresh rollups; the admin
+-- endpoint checks ADMIN_API_KEY before calling it
+REVOKE EXECUTE ON FUNCTION refresh_analytics_rollups(BOOLEAN) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION refresh_analytics_rollups(BOOLEAN) TO service_role;
+
+-- Range totals for the bookings rollup, one row per city and one per technician
+CREATE OR REPLACE FUNCTION analytics_bookings_summary(date_from DATE, date_to DATE, filter_city TEXT DEFAULT NULL)
+RETURNS TABLE (
+  dimension TEXT,
+  city TEXT,
+  technician_id BIGINT,
+  bookings BIGINT,
+  paid_bookings BIGINT,
+  completed_bookings BIGINT,
+  booked_amount DECIMAL(12,2)
+) AS $$
+  SELECT CASE WHEN GROUPING(r.city) = 0 THEN 'city' ELSE 'technician' END,
+         r.city,
+         r.technician_id,
+         SUM(r.bookings),
+         SUM(r.paid_bookings),
+         SUM(r.completed_bookings),
+         SUM(r.booked_amount)
+    FROM analytics_daily_bookings r
+   WHERE r.day BETWEEN date_from AND date_to
+     AND (filter_city IS NULL OR r.city = filter_city)
+   GROUP BY GROUPING SETS ((r.city), (r.technician_id))
+   ORDER BY 1, 4 DESC;
+$$ LANGUAGE sql STABLE;
+
+ALTER TABLE analytics_daily_revenue ENABLE ROW LEVEL SECURITY;
+ALTER TABLE analytics_daily_funnel ENABLE ROW LEVEL SECURITY;
+ALTER TABLE analytics_daily_bookings ENABLE ROW LEVEL SECURITY;
+ALTER TABLE analytics_refresh_state ENABLE ROW LEVEL SECURITY;
+
+-- Rollups are written only by refresh_analytics_rollups(); the API only reads them
+CREATE POLICY "Read analytics_daily_revenue" ON analytics_daily_revenue FOR SELECT USING (true);
+CREATE POLICY "Read analytics_daily_funnel" ON analytics_daily_funnel FOR SELECT USING (true);
+CREATE POLICY "Read analytics_daily_bookings" ON analytics_daily_bookings FOR SELECT USING (true);
+CREATE POLICY "Read analytics_refresh_state" ON analytics_refresh_state FOR SELECT USING (true);
+
+-- Optional: refresh every 15 minutes with pg_cron (Database > Extensions in Supabase)
+-- SELECT cron.schedule('refresh-analytics', '*/15 * * * *', 'SELECT refresh_analytics_rollups()');
+
 -- Insert sample technicians
 INSERT INTO technicians (name, phone, email, specialization, city) VALUES
   ('Rajesh Kumar', '+919876543210', 'rajesh@boltnexus.com', 'AC', 'Mumbai'),